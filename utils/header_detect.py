@@ -0,0 +1,73 @@
+import re
+from functools import lru_cache
+
+# ==================== 标题行识别（各模块共用） ====================
+# 每种报表一组关键字；单元格文本先过一次预编译的多关键字正则，命中后才确认具体关键字
+
+HEADER_PROFILES = {
+    # 初始保证金 WSBZJQKB：按优先级，先找合同编号，找不到再找业务部门
+    "margin_init": ("合同编号", "业务部门"),
+    # 追加保证金填报表
+    "margin_add": ('序号', '大区', '经营部', '品种', '客户名称', '合同编号', '合同数量', '合同单价',
+                   '调整后待追加保证金金额', '逾期天数', '调整后待执行数量'),
+    # 信用日报：战略客户逾期通报
+    "credit_word": ("品种线", "大区", "经营部", "客户名称", "合同号", "品种", "逾期天数", "逾期金额"),
+    # 信用日报：导出图片的表头起始行
+    "credit_image": ("序号", "业务单位", "大区"),
+}
+
+@lru_cache(maxsize=None)
+def keyword_matcher(profile):
+    """关键字编译为一条交替正则（长词在前），按报表缓存"""
+    keywords = sorted(HEADER_PROFILES[profile], key=len, reverse=True)
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+def text_has_keyword(text, profile):
+    return bool(text) and keyword_matcher(profile).search(text) is not None
+
+def cell_keywords(text, profile):
+    """单元格命中的全部关键字（含互为子串的，如 品种/品种线），按配置顺序"""
+    if not text_has_keyword(text, profile): return ()
+    return tuple(k for k in HEADER_PROFILES[profile] if k in text)
+
+def scan_rows(rows, max_rows=None, max_cols=None):
+    """逐行产出 (行号(1起), 原始值)，按需截断行列；rows 可以是 iter_rows(values_only=True) 的流"""
+    for idx, row in enumerate(rows, 1):
+        if max_rows is not None and idx > max_rows: return
+        yield idx, (row[:max_cols] if max_cols is not None else row)
+
+def locate_by_priority(rows, profile, max_rows=None, max_cols=None):
+    """按关键字优先级找标题行：返回最高优先级关键字首次出现的行号，均未出现返回 None"""
+    keywords = HEADER_PROFILES[profile]
+    first_seen = {}
+    for idx, row in scan_rows(rows, max_rows, max_cols):
+        for val in row:
+            for k in cell_keywords(str(val) if val is not None else "", profile): first_seen.setdefault(k, idx)
+        if keywords[0] in first_seen: break
+    return next((first_seen[k] for k in keywords if k in first_seen), None)
+
+def locate_by_score(rows, profile, max_rows=None):
+    """
+    按命中程度找标题行：命中关键字的单元格数 ≥2 或非空单元格 >5 的行为候选，
+    取 (命中数, 非空数) 最大者，同分取靠前的行；无候选返回 None
+    """
+    best = None
+    for idx, row in scan_rows(rows, max_rows):
+        values = [str(v).strip() for v in row if v]
+        key_count = sum(1 for v in values if text_has_keyword(v, profile))
+        if key_count >= 2 or len(values) > 5:
+            score = (key_count, sum(1 for v in values if v))
+            if best is None or score > best[0]: best = (score, idx)
+    return best[1] if best else None
+
+def locate_by_coverage(rows, profile, min_hits, max_rows=None):
+    """
+    按关键字覆盖数找标题行：首个覆盖 ≥ min_hits 个不同关键字的行
+    返回 (行号, {关键字: 列序号(0起)})；同一关键字出现在多列时取最后一列；找不到返回 (None, {})
+    """
+    for idx, row in scan_rows(rows, max_rows):
+        col_map = {}
+        for c_idx, val in enumerate(row):
+            for k in cell_keywords(str(val).strip() if val is not None else "", profile): col_map[k] = c_idx
+        if len(col_map) >= min_hits: return idx, col_map
+    return None, {}
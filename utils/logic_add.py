@@ -1,10 +1,17 @@
 import pandas as pd
+import numpy as np
 import io
+import os
+import json
 import copy
 import openpyxl
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
+from xml.etree import ElementTree
+from utils.header_detect import locate_by_score
+from utils.used_range import read_bounded_rows, extent_log
 from datetime import datetime
 
 # ============================================================================
@@ -53,42 +60,64 @@ def format_number_with_thousands_zj(value):
         return f"{int_value:,}"
     except Exception as e: return str(value)
 
-def find_header_row_zj(ws, max_rows_to_check=30):
-    key_columns = ['序号', '大区', '经营部', '品种', '客户名称', '合同编号', '合同数量', '合同单价', '调整后待追加保证金金额', '逾期天数', '调整后待执行数量']
-    header_candidates = []
-    for row_idx in range(1, min(max_rows_to_check, ws.max_row) + 1):
-        row_values = []
-        key_count = 0
-        for col_idx in range(1, ws.max_column + 1):
-            cell_value = ws.cell(row=row_idx, column=col_idx).value
-            if cell_value:
-                cell_str = str(cell_value).strip()
-                row_values.append(cell_str)
-                for key in key_columns:
-                    if key in cell_str:
-                        key_count += 1
-                        break
-        if key_count >= 2 or len(row_values) > 5:
-            non_null_count = sum(1 for v in row_values if v and str(v).strip())
-            header_candidates.append({'row': row_idx, 'key_count': key_count, 'non_null_count': non_null_count})
-    if not header_candidates: return 5
-    header_candidates.sort(key=lambda x: (x['key_count'], x['non_null_count']), reverse=True)
-    return header_candidates[0]['row']
-
-def get_column_mapping_zj(ws, header_row):
-    column_mapping = {}
-    reverse_mapping = {}
-    for col_idx in range(1, ws.max_column + 1):
-        cell = ws.cell(row=header_row, column=col_idx)
-        col_name = cell.value
-        if not col_name or str(col_name).strip() == '': col_name = f'Unnamed_{col_idx}'
-        else: col_name = str(col_name).strip()
-        column_mapping[col_idx] = col_name
-        reverse_mapping[col_name] = col_idx
-    return column_mapping, reverse_mapping
+def _is_numeric_zj(values):
+    return pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+
+def _fixed2_zj(values):
+    """按 f"{v:.2f}" 的规则批量格式化（printf 与 Python 同为精确舍入）"""
+    return pd.Series(np.char.mod('%.2f', values.to_numpy(dtype=float)), index=values.index, dtype=object)
+
+def format_money_series_zj(values):
+    """smart_format_money_zj 的整列版本，输出逐字相同"""
+    values = pd.Series(values)
+    if not _is_numeric_zj(values): return values.map(smart_format_money_zj)
+    v = values.astype(float)
+    r = v.round()
+    out = r.fillna(0).astype('int64').astype(str).astype(object)
+    out = out.where(r != 0, _fixed2_zj(v))
+    return out.where(~(v.isna() | (v.abs() < 0.000001)), "0")
+
+def format_volume_series_zj(values, unit="万吨"):
+    """smart_format_volume_zj 的整列版本，输出逐字相同"""
+    values = pd.Series(values)
+    if not _is_numeric_zj(values): return values.map(lambda x: smart_format_volume_zj(x, unit))
+    v = values.astype(float)
+    s = _fixed2_zj(v).str.rstrip('0').str.rstrip('.').replace("", "0") + unit
+    tons = (v * 10000).round().fillna(0).astype('int64').astype(str) + "吨"
+    out = s.where(~((v.abs() >= 0.0001) & (v.abs() < 0.005)), tons)
+    return out.where(v.notna(), f"0{unit}")
+
+def format_date_series_zj(values):
+    """smart_format_date_zj 的整列版本，输出逐字相同"""
+    values = pd.Series(values)
+    if not pd.api.types.is_datetime64_any_dtype(values): return values.map(smart_format_date_zj)
+    out = values.dt.month.astype('Int64').astype(str) + "月" + values.dt.day.astype('Int64').astype(str) + "日"
+    return out.where(values.notna(), "").astype(object)
+
+def format_thousands_series_zj(values):
+    """format_number_with_thousands_zj 的整列版本，输出逐字相同"""
+    values = pd.Series(values)
+    if not _is_numeric_zj(values): return values.map(format_number_with_thousands_zj)
+    v = values.astype(float)
+    r = v.round()
+    out = r.fillna(0).astype('int64').astype(str).str.replace(r'(\d)(?=(\d{3})+$)', r'\1,', regex=True).astype(object)
+    out = out.where(~((r == 0) & (v.abs() > 0)), _fixed2_zj(v))
+    return out.where(~(v.isna() | (v == 0)), "0")
+
+def locate_header_row_zj(rows, max_rows_to_check=30):
+    """前 max_rows_to_check 行中关键字命中最多的行；无候选时默认第 5 行"""
+    return locate_by_score(rows, "margin_add", max_rows_to_check) or 5
+
+def column_names_zj(header_values):
+    return {col_idx: (str(v).strip() if v is not None and str(v).strip() != '' else f'Unnamed_{col_idx}')
+            for col_idx, v in enumerate(header_values, 1)}
 
 def copy_cell_style_zj(source_cell, target_cell):
+    """复制单元格样式；同一工作簿内直接复用样式 ID，跨工作簿才逐项复制"""
     if source_cell.has_style:
+        if source_cell.parent.parent is target_cell.parent.parent:
+            target_cell._style = copy.copy(source_cell._style)
+            return target_cell
         target_cell.font = copy.copy(source_cell.font)
         target_cell.border = copy.copy(source_cell.border)
         target_cell.fill = copy.copy(source_cell.fill)
@@ -97,423 +126,527 @@ def copy_cell_style_zj(source_cell, target_cell):
         target_cell.alignment = copy.copy(source_cell.alignment)
     return target_cell
 
-def apply_excel_like_filtering_zj(ws_original, ws_processed):
+def read_margin_frame_zj(ws, logs=None):
+    """
+    流式读取追加保证金明细：一次 iter_rows(values_only=True) 得到有效数据范围内的全部数据
+    返回 (标题行号, {列号: 列名}, DataFrame)；DataFrame 的 index 为原表行号
+    传入 logs 时，声明范围虚大会记一条日志
+    """
+    rows, declared, used = read_bounded_rows(ws)
+    message = extent_log(ws.title, declared, used)
+    if logs is not None and message: logs.append(message)
+    header_row = locate_header_row_zj(rows)
+    header_values = rows[header_row - 1] if header_row <= len(rows) else ()
+    width = max((len(r) for r in rows), default=0)
+    column_mapping = column_names_zj(tuple(header_values) + (None,) * (width - len(header_values)))
+    data = [tuple(r) + (None,) * (width - len(r)) for r in rows[header_row:]]
+    df = pd.DataFrame(data, columns=range(1, width + 1), index=range(header_row + 1, header_row + 1 + len(data)), dtype=object)
+    return header_row, column_mapping, df
+
+def load_margin_frame_zj(uploaded_file, logs=None):
+    """只读模式加载首个工作表读出分析用数据，不解析样式；带格式的输出另行加载"""
+    wb = openpyxl.load_workbook(uploaded_file, read_only=True)
+    try: return read_margin_frame_zj(wb.worksheets[0], logs)
+    finally: wb.close()
+
+# 筛选规则：每条描述一类“剔除”条件；可用环境变量 CTMR_SCREENING_RULES 指向 JSON 文件覆盖
+# column: 表头包含的关键字；column_excludes: 表头不得包含的关键字
+# op: le/lt/ge/gt 按数值比较（空值按 0，无法转数值的行一律剔除）；eq/in 按文本比较
+SCREENING_RULES_ZJ = [
+    {'name': '待追加金额≤0.01', 'column': '调整后待追加保证金金额', 'op': 'le', 'value': 0.01},
+    {'name': '待执行数量调整原因', 'column': '待执行数量调整原因分类', 'op': 'in', 'value': ["合同不再继续执行", "合同约定免收追加保证金"]},
+    {'name': '保证金已收未认领', 'column': '逾期未回款原因分类', 'op': 'eq', 'value': "C:追加保证金实际已收到，尚未认领"},
+    {'name': '玉米中心', 'column': '大区', 'column_excludes': '玉米中心', 'op': 'eq', 'value': "玉米中心"},
+]
+SCREENING_RULES_ENV_ZJ = 'CTMR_SCREENING_RULES'
+SCREENING_NUMERIC_OPS_ZJ = ('le', 'lt', 'ge', 'gt')
+SCREENING_OPS_ZJ = SCREENING_NUMERIC_OPS_ZJ + ('eq', 'in')
+_compiled_screening_zj = {}
+
+def load_screening_rules_zj(path=None):
+    """读取筛选规则 JSON；未配置时使用内置规则，文件读不到或不是合法 JSON 时报错"""
+    path = path or os.environ.get(SCREENING_RULES_ENV_ZJ)
+    if not path: return SCREENING_RULES_ZJ
     try:
-        header_row_idx = find_header_row_zj(ws_original)
-        column_mapping, _ = get_column_mapping_zj(ws_original, header_row_idx)
-
-        for col_idx in range(1, ws_original.max_column + 1):
-            source = ws_original.cell(row=header_row_idx, column=col_idx)
-            target = ws_processed.cell(row=1, column=col_idx)
-            target.value = source.value
-            copy_cell_style_zj(source, target)
-        
-        data_rows = []
-        for row_idx in range(header_row_idx + 1, ws_original.max_row + 1):
-            row_data = []
-            for col_idx in range(1, ws_original.max_column + 1):
-                row_data.append(ws_original.cell(row=row_idx, column=col_idx).value)
-            data_rows.append((row_idx, row_data))
-        
-        am_idx = ak_idx = as_idx = b_idx = None
-        for idx, name in column_mapping.items():
-            s = str(name)
-            if '调整后待追加保证金金额' in s: am_idx = idx
-            elif '待执行数量调整原因分类' in s: ak_idx = idx
-            elif '逾期未回款原因分类' in s: as_idx = idx
-            elif '大区' in s and '玉米中心' not in s: b_idx = idx
-
-        if not all([am_idx, ak_idx, as_idx, b_idx]): return [], column_mapping
-
-        filtered_rows = []
-        for r_idx, r_data in data_rows:
-            include = True
-            try:
-                val = float(r_data[am_idx-1]) if r_data[am_idx-1] is not None else 0
-                if val <= 0.01: include = False
-            except: include = False
-
-            if include:
-                val = str(r_data[ak_idx-1]) if r_data[ak_idx-1] else ""
-                if val in ["合同不再继续执行", "合同约定免收追加保证金"]: include = False
-            
-            if include:
-                val = str(r_data[as_idx-1]) if r_data[as_idx-1] else ""
-                if val == "C:追加保证金实际已收到，尚未认领": include = False
-
-            if include:
-                val = str(r_data[b_idx-1]) if r_data[b_idx-1] else ""
-                if val == "玉米中心": include = False
-
-            if include:
-                filtered_rows.append((r_idx, r_data))
-
-        curr_row = 2
-        for s_idx, r_data in filtered_rows:
-            for c_idx, val in enumerate(r_data, 1):
-                s_cell = ws_original.cell(row=s_idx, column=c_idx)
-                t_cell = ws_processed.cell(row=curr_row, column=c_idx)
-                t_cell.value = val
-                copy_cell_style_zj(s_cell, t_cell)
-            curr_row += 1
-
-        for col in range(1, ws_original.max_column + 1):
-            col_letter = get_column_letter(col)
-            if ws_original.column_dimensions[col_letter].width:
-                ws_processed.column_dimensions[col_letter].width = ws_original.column_dimensions[col_letter].width
-        
-        ws_processed.freeze_panes = 'A2'
-        return filtered_rows, column_mapping
-    except: return [], {}
-
-def generate_analysis_report_zj(df_processed, today_display):
+        with open(path, encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"筛选规则文件 {path} 无法读取: {e}") from e
+
+def rule_problem_zj(rule):
+    """单条规则的格式问题；无问题返回 None"""
+    if not isinstance(rule, dict): return "不是对象"
+    missing = [k for k in ('name', 'column', 'op', 'value') if k not in rule]
+    if missing: return f"缺少字段 {'、'.join(missing)}"
+    if not isinstance(rule['column'], str) or not rule['column']: return "column 须为非空字符串"
+    if rule.get('column_excludes') is not None and not isinstance(rule['column_excludes'], str): return "column_excludes 须为字符串"
+    op, value = rule['op'], rule['value']
+    if op not in SCREENING_OPS_ZJ: return f"不支持的运算符 {op!r}（可用：{'/'.join(SCREENING_OPS_ZJ)}）"
+    if op in SCREENING_NUMERIC_OPS_ZJ and (isinstance(value, bool) or not isinstance(value, (int, float))): return f"运算符 {op} 的 value 须为数字"
+    if op == 'eq' and not isinstance(value, str): return "运算符 eq 的 value 须为字符串"
+    if op == 'in' and not (isinstance(value, list) and all(isinstance(v, str) for v in value)): return "运算符 in 的 value 须为字符串列表"
+    return None
+
+def validate_screening_rules_zj(rules):
+    """规则格式有误时抛出 ValueError，指明出错的规则"""
+    if not isinstance(rules, list) or not rules: raise ValueError("筛选规则须为非空列表")
+    for i, rule in enumerate(rules, 1):
+        problem = rule_problem_zj(rule)
+        if problem:
+            label = rule.get('name', '') if isinstance(rule, dict) else ''
+            raise ValueError(f"筛选规则第 {i} 条「{label}」有误：{problem}")
+
+def resolve_rule_columns_zj(rules, column_mapping):
+    """每列只归属第一条匹配的规则，同一规则取最后一个匹配列；有规则找不到对应列时抛出 ValueError"""
+    cols = [None] * len(rules)
+    for idx, name in column_mapping.items():
+        s = str(name)
+        for i, rule in enumerate(rules):
+            if rule['column'] in s and not (rule.get('column_excludes') and rule['column_excludes'] in s):
+                cols[i] = idx
+                break
+    missing = [f"「{rule['name']}」（{rule['column']}）" for rule, col in zip(rules, cols) if col is None]
+    if missing: raise ValueError(f"表中找不到筛选规则所需的列：{'、'.join(missing)}")
+    return cols
+
+def rule_exclusion_zj(col, rule):
+    """单条规则的剔除掩码"""
+    op, value = rule['op'], rule['value']
+    if op in SCREENING_NUMERIC_OPS_ZJ:
+        num = col.where(col.map(type) != str, col.astype(str).str.strip())
+        num = pd.to_numeric(num.fillna(0), errors='coerce')
+        hit = {'le': num <= value, 'lt': num < value, 'ge': num >= value, 'gt': num > value}[op]
+        return hit | num.isna()
+    text = col.astype(str).where(col.notna() & (col != ""), "")
+    if op == 'eq': return text == value
+    if op == 'in': return text.isin(value)
+    raise ValueError(f"未知的筛选运算符: {op}")
+
+def compile_screening_rules_zj(rules, column_mapping):
+    """按 (规则, 表头) 校验、编译一次并缓存；返回 df -> (保留掩码, {规则名: 剔除行数})"""
+    validate_screening_rules_zj(rules)
+    key = (json.dumps(rules, ensure_ascii=False, sort_keys=True),
+           tuple((idx, str(name)) for idx, name in column_mapping.items()))
+    if key in _compiled_screening_zj: return _compiled_screening_zj[key]
+    cols = resolve_rule_columns_zj(rules, column_mapping)
+    def fn(df):
+        dropped = pd.Series(False, index=df.index)
+        counts = {}
+        for rule, idx in zip(rules, cols):
+            hit = rule_exclusion_zj(df[idx], rule)
+            counts[rule['name']] = int((hit & ~dropped).sum())
+            dropped |= hit
+        return ~dropped, counts
+    _compiled_screening_zj[key] = fn
+    return fn
+
+def screening_mask_zj(df, column_mapping, rules=None):
+    """筛选规则的保留掩码及各规则剔除行数（按规则顺序归属）；规则有误或缺列时抛出 ValueError"""
+    return compile_screening_rules_zj(rules or load_screening_rules_zj(), column_mapping)(df)
+
+def named_frame_zj(df, column_mapping):
+    """将按列号存储的筛选结果转为按列名的分析用 DataFrame；重名列保留首次出现的位置、取最后一列的值"""
+    names = [column_mapping[c] for c in df.columns]
+    last_col = {name: col for col, name in zip(df.columns, names)}
+    ordered = list(dict.fromkeys(names))
+    return pd.DataFrame(df[[last_col[n] for n in ordered]].values.tolist(), columns=ordered)
+
+def copy_filtered_rows_zj(ws_original, ws_processed, header_row, source_rows, max_col):
+    for col_idx in range(1, max_col + 1):
+        source = ws_original.cell(row=header_row, column=col_idx)
+        target = ws_processed.cell(row=1, column=col_idx)
+        target.value = source.value
+        copy_cell_style_zj(source, target)
+
+    for curr_row, s_idx in enumerate(source_rows, 2):
+        for c_idx in range(1, max_col + 1):
+            s_cell = ws_original.cell(row=s_idx, column=c_idx)
+            t_cell = ws_processed.cell(row=curr_row, column=c_idx)
+            t_cell.value = s_cell.value
+            copy_cell_style_zj(s_cell, t_cell)
+
+    for col in range(1, max_col + 1):
+        col_letter = get_column_letter(col)
+        if ws_original.column_dimensions[col_letter].width:
+            ws_processed.column_dimensions[col_letter].width = ws_original.column_dimensions[col_letter].width
+    ws_processed.freeze_panes = 'A2'
+
+def sheet_column_widths_zj(ws, max_col):
+    """只读工作表没有 column_dimensions，直接从 XML 的 <cols> 读列宽（读到 sheetData 即停）"""
+    widths = {}
     try:
-        d_col = b_col = exec_qty_col = am_col = trigger_date_col = an_col = deposit_type_col = None
-        for col_name in df_processed.columns:
-            col_str = str(col_name)
-            if '细分品种' in col_str: d_col = col_name
-            elif '大区' in col_str and '玉米中心' not in col_str: b_col = col_name
-            elif '调整后待执行数量' in col_str: exec_qty_col = col_name
-            elif '调整后待追加保证金金额' in col_str: am_col = col_name
-            elif ('追加保证金触发日期' in col_str or '触发日期' in col_str) and '到期' not in col_str: trigger_date_col = col_name
-            elif '逾期' in col_str and '天' in col_str: an_col = col_name
-            elif '保证金类型' in col_str: deposit_type_col = col_name
-
-        if not exec_qty_col or not am_col: return "分析报告生成失败：缺少必要的列数据。"
-
-        df_processed[exec_qty_col] = pd.to_numeric(df_processed[exec_qty_col], errors='coerce')
-        df_processed[am_col] = pd.to_numeric(df_processed[am_col], errors='coerce')
-        if an_col: df_processed[an_col] = pd.to_numeric(df_processed[an_col], errors='coerce')
-        if trigger_date_col: df_processed[trigger_date_col] = pd.to_datetime(df_processed[trigger_date_col], errors='coerce')
-
-        total_contracts = len(df_processed)
-        total_exec_qty = df_processed[exec_qty_col].sum() / 10000
-        total_am_amount = df_processed[am_col].sum()
-
-        deposit_amount_parts = []
-        if deposit_type_col:
-            df_processed[deposit_type_col] = df_processed[deposit_type_col].astype(str)
-            down_deposit = df_processed[df_processed[deposit_type_col].str.contains('跌价', na=False)][am_col].sum()
-            up_deposit = df_processed[df_processed[deposit_type_col].str.contains('涨价', na=False)][am_col].sum()
-            if down_deposit > 0.000001: deposit_amount_parts.append(f"应收取跌价保证金{smart_format_money_zj(down_deposit)}万元")
-            if up_deposit > 0.000001: deposit_amount_parts.append(f"应收取涨价保证金{smart_format_money_zj(up_deposit)}万元")
-            if not deposit_amount_parts: deposit_amount_str = f"应收取追加保证金{smart_format_money_zj(total_am_amount)}万元"
-            else: deposit_amount_str = "、".join(deposit_amount_parts)
-        else: deposit_amount_str = f"应收取追加保证金{smart_format_money_zj(total_am_amount)}万元"
-
-        product_summary = []
-        if d_col:
-            for product, group in df_processed.groupby(d_col):
-                amt = group[am_col].sum()
-                if amt > 0.000001: product_summary.append(f"{product}{smart_format_money_zj(amt)}万元")
-        product_summary_str = "，".join(product_summary)
-
-        trigger_date_summary = []
-        trigger_date_summary_str = ""
-        overdue_contracts = 0
-        overdue_amount = 0
-        if trigger_date_col:
-            df_sorted = df_processed.sort_values(by=trigger_date_col)
-            if an_col:
-                mask = df_processed[an_col] > 0
-                overdue_contracts = mask.sum()
-                if overdue_contracts > 0: overdue_amount = df_processed.loc[mask, am_col].sum()
-            for date, group in df_sorted.groupby(trigger_date_col):
-                if pd.notnull(date):
-                    date_str = smart_format_date_zj(date)
-                    d_amt = group[am_col].sum()
-                    o_str = ""
-                    if an_col:
-                        od = group[an_col].dropna()
-                        if not od.empty and od.max() > 0: o_str = f"（逾期{int(od.max())}天）"
-                    if d_amt > 0.000001: trigger_date_summary.append(f"{date_str}触发{smart_format_money_zj(d_amt)}万元{o_str}")
-            trigger_date_summary_str = "，".join(trigger_date_summary)
-
-        region_summary = []
-        if b_col:
-            r_data = []
-            for region, group in df_processed.groupby(b_col):
-                r_data.append({'region': region, 'contracts': len(group), 'exec_qty': group[exec_qty_col].sum()/10000, 'am_amount': group[am_col].sum()})
-            r_data.sort(key=lambda x: x['am_amount'], reverse=True)
-            for i, r in enumerate(r_data, 1):
-                region_summary.append(f"{i}、{r['region']}：{r['contracts']}笔，待执行数量{smart_format_volume_zj(r['exec_qty'])}，需追加保证金金额{smart_format_money_zj(r['am_amount'])}万元。")
-        region_summary_str = "\n".join(region_summary)
-
-        report_base = f"""截至{today_display}，存续追加保证金合同{total_contracts}笔，对应待执行量{smart_format_volume_zj(total_exec_qty)}，{deposit_amount_str}"""
-        if product_summary_str: report_base += f"。分品种看，{product_summary_str}"
-        if overdue_contracts > 0: report_base += f"。其中，{overdue_contracts}笔合同已逾期，逾期金额{smart_format_money_zj(overdue_amount)}万元"
-        if trigger_date_summary_str:
-            sep = "。" if overdue_contracts > 0 else "。其中，"
-            report_base += f"{sep}{trigger_date_summary_str}"
-        return report_base + f"。分大区情况如下：\n{region_summary_str}"
+        with ws._get_source() as src:
+            for _, el in ElementTree.iterparse(src, events=('start',)):
+                tag = el.tag.rsplit('}', 1)[-1]
+                if tag == 'sheetData': break
+                if tag == 'col' and el.get('width'):
+                    for c in range(int(el.get('min')), min(int(el.get('max')), max_col) + 1): widths[c] = float(el.get('width'))
+    except: pass
+    return widths
+
+def stream_filtered_rows_zj(ws_source, ws_out, header_row, source_rows, max_col):
+    """只读源表 -> 只写目标表：流式复制标题行与保留行，样式按源样式 ID 缓存只转换一次"""
+    for col, width in sheet_column_widths_zj(ws_source, max_col).items():
+        ws_out.column_dimensions[get_column_letter(col)].width = width
+    ws_out.freeze_panes = 'A2'
+
+    styles = {}
+    def clone(cell):
+        out = WriteOnlyCell(ws_out, value=cell.value)
+        style_id = getattr(cell, '_style_id', 0)
+        if not style_id: return out
+        if style_id in styles:
+            out._style = copy.copy(styles[style_id])
+            return out
+        out.font, out.border, out.fill = copy.copy(cell.font), copy.copy(cell.border), copy.copy(cell.fill)
+        out.number_format, out.protection, out.alignment = cell.number_format, copy.copy(cell.protection), copy.copy(cell.alignment)
+        styles[style_id] = copy.copy(out._style)
+        return out
+
+    keep = set(source_rows) | {header_row}
+    last = max(keep)
+    for r_idx, row in enumerate(ws_source.iter_rows(max_col=max_col), 1):
+        if r_idx > last: break
+        if r_idx in keep: ws_out.append([clone(c) for c in row])
+
+def apply_excel_like_filtering_zj(ws_original, ws_processed=None, logs=None, frame=None):
+    """
+    按筛选规则筛选原表；只有传入 ws_processed 时才复制保留行的值与样式
+    ws_processed 属于只写工作簿时按行流式写入（源表可为只读模式）
+    frame: 已读出的 (标题行号, {列号: 列名}, DataFrame)，不传则从 ws_original 读取
+    返回 (筛选后的分析用 DataFrame, {列号: 列名}, {规则名: 剔除行数})；规则有误或缺列时抛出 ValueError
+    """
+    header_row, column_mapping, df = frame or read_margin_frame_zj(ws_original, logs)
+    mask, counts = screening_mask_zj(df, column_mapping)
+    df_kept = df[mask]
+    if ws_processed is not None and ws_processed.parent.write_only: stream_filtered_rows_zj(ws_original, ws_processed, header_row, df_kept.index, len(column_mapping))
+    elif ws_processed is not None: copy_filtered_rows_zj(ws_original, ws_processed, header_row, df_kept.index, len(column_mapping))
+    return named_frame_zj(df_kept, column_mapping), column_mapping, counts
+
+# 报表用列角色：角色 -> (表头须同时包含的关键字, 表头不得包含的关键字)；每列只归属第一个匹配的角色
+COLUMN_ROLES_ZJ = {
+    '大区': (('大区',), ('玉米中心',)),
+    '经营部': (('经营部',), ()),
+    '客户名称': (('客户', '名称'), ()),
+    '细分品种': (('细分品种',), ()),
+    '调整后待执行数量': (('调整后待执行数量',), ()),
+    '调整后待追加保证金金额': (('调整后待追加保证金金额',), ()),
+    '触发日期': (('触发日期',), ('到期',)),
+    '逾期天数': (('逾期', '天'), ()),
+    '保证金类型': (('保证金类型',), ()),
+}
+_column_roles_zj = {}
+
+def resolve_column_roles_zj(columns):
+    """按表头签名缓存的列角色解析；返回 {角色: 列名或 None}"""
+    key = tuple(str(c) for c in columns)
+    if key in _column_roles_zj: return _column_roles_zj[key]
+    roles = dict.fromkeys(COLUMN_ROLES_ZJ)
+    for col in columns:
+        s = str(col)
+        for role, (must, never) in COLUMN_ROLES_ZJ.items():
+            if all(k in s for k in must) and not any(k in s for k in never):
+                roles[role] = col
+                break
+    _column_roles_zj[key] = roles
+    return roles
+
+# 定型列：数值 float64、触发日期 datetime64、其余分组键 category
+NUMERIC_ROLES_ZJ = ('调整后待执行数量', '调整后待追加保证金金额', '逾期天数')
+
+def typed_margin_frame_zj(df, roles=None):
+    """
+    一次性把报表用列转为定型列，列名即角色名；原 DataFrame 不变
+    之后的立方体与各报告只读此表，不再重复 to_numeric / to_datetime
+    """
+    roles = roles or resolve_column_roles_zj(df.columns)
+    typed = {}
+    for role, col in roles.items():
+        if col is None: continue
+        if role in NUMERIC_ROLES_ZJ: typed[role] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        elif role == '触发日期': typed[role] = pd.to_datetime(df[col], errors='coerce')
+        else: typed[role] = df[col].astype('category')
+    return pd.DataFrame(typed, index=df.index)
+
+# 立方体维度与度量：度量按 max/min/sum 逐级汇总
+CUBE_DIMS_ZJ = ('大区', '经营部', '客户名称', '细分品种', '保证金类型', '触发日期')
+CUBE_AGG_ZJ = {'合同笔数': 'sum', '调整后待执行数量': 'sum', '调整后待追加保证金金额': 'sum',
+               '逾期天数': 'max', '逾期笔数': 'sum', '逾期金额': 'sum', '_序': 'min'}
+
+def build_margin_cube_zj(typed):
+    """
+    由定型表（typed_margin_frame_zj）一次聚合出 大区×经营部×客户×品种×保证金类型×触发日期 的明细表
+    度量：合同笔数、待执行数量、待追加金额、最长逾期天数、逾期笔数/金额、首次出现顺序(_序)
+    """
+    dims = [d for d in CUBE_DIMS_ZJ if d in typed]
+    flat = {d: typed[d] for d in dims}
+    flat['合同笔数'] = 1
+    for role in NUMERIC_ROLES_ZJ:
+        if role in typed: flat[role] = typed[role]
+    if '逾期天数' in flat:
+        overdue = flat['逾期天数'] > 0
+        flat['逾期笔数'] = overdue.astype(int)
+        if '调整后待追加保证金金额' in flat: flat['逾期金额'] = flat['调整后待追加保证金金额'].where(overdue)
+    flat['_序'] = range(len(typed))
+    flat = pd.DataFrame(flat, index=typed.index)
+    if not dims: return flat
+    agg = {c: how for c, how in CUBE_AGG_ZJ.items() if c in flat}
+    return flat.groupby(dims, dropna=False, sort=False, observed=True).agg(agg).reset_index()
+
+# 立方体二次汇总与逐行求和的浮点尾差不同，排序键先按此精度取整，避免并列项顺序被尾差打乱
+SORT_KEY_DECIMALS_ZJ = 6
+
+def sort_key_zj(values):
+    return -values.round(SORT_KEY_DECIMALS_ZJ)
+
+def rollup_zj(cube, dim):
+    """按单个维度汇总（键排序、丢弃空键，与原 groupby 一致）"""
+    return cube.groupby(dim, observed=True).agg({c: how for c, how in CUBE_AGG_ZJ.items() if c in cube}).reset_index()
+
+def ordered_labels_zj(cube, key, dim, skip_blank=False):
+    """每个 key 下 dim 的取值，按首次出现顺序以“、”连接"""
+    pairs = cube.groupby([key, dim], sort=False, observed=True)['_序'].min().reset_index().sort_values('_序', kind='stable')
+    pairs = pairs.astype({key: object, dim: object})
+    if skip_blank: pairs = pairs[pairs[dim].astype(str).str.strip() != ""]
+    return pairs.groupby(key, sort=False)[dim].agg(lambda v: "、".join(str(x) for x in v))
+
+def cube_missing_zj(cube, required):
+    """立方体缺失的必需列；为空时返回空串，否则返回可直接拼进报告的提示"""
+    missing = [r for r in required if r not in cube]
+    return f"缺少必要列（{'、'.join(missing)}）" if missing else ""
+
+def overview_text_zj(cube, scope_label, today_display, overdue_needs_trigger=False):
+    """
+    总量段落：合同数、待执行量、保证金类型拆分、分品种、逾期与分触发日期
+    overdue_needs_trigger: 全公司报告只在有触发日期列时统计逾期（与原报告一致）
+    """
+    am = cube['调整后待追加保证金金额']
+    total_am_amount = am.sum()
+    deposit_amount_parts = []
+    if '保证金类型' in cube:
+        d_type = cube['保证金类型'].astype(str)
+        down_deposit = am[d_type.str.contains('跌价', na=False)].sum()
+        up_deposit = am[d_type.str.contains('涨价', na=False)].sum()
+        if down_deposit > 0.000001: deposit_amount_parts.append(f"应收取跌价保证金{smart_format_money_zj(down_deposit)}万元")
+        if up_deposit > 0.000001: deposit_amount_parts.append(f"应收取涨价保证金{smart_format_money_zj(up_deposit)}万元")
+    deposit_amount_str = "、".join(deposit_amount_parts) or f"应收取追加保证金{smart_format_money_zj(total_am_amount)}万元"
+
+    prod_summary_str = ""
+    if '细分品种' in cube:
+        prods = rollup_zj(cube, '细分品种')
+        prods = prods[prods['调整后待追加保证金金额'] > 0.000001]
+        prod_summary_str = "，".join(prods['细分品种'].astype(str) + format_money_series_zj(prods['调整后待追加保证金金额']) + "万元")
+
+    trigger_str = ""
+    if '触发日期' in cube:
+        dates = rollup_zj(cube, '触发日期')
+        dates = dates[dates['调整后待追加保证金金额'] > 0.000001]
+        od = dates['逾期天数'] if '逾期天数' in dates else pd.Series(float('nan'), index=dates.index)
+        od_str = ("（逾期" + od.fillna(0).astype('int64').astype(str) + "天）").where(od > 0, "")
+        trigger_str = "，".join(format_date_series_zj(dates['触发日期']) + "触发" + format_money_series_zj(dates['调整后待追加保证金金额']) + "万元" + od_str)
+
+    count_overdue = '逾期笔数' in cube and ('触发日期' in cube or not overdue_needs_trigger)
+    overdue_contracts = int(cube['逾期笔数'].sum()) if count_overdue else 0
+    overdue_amount = cube['逾期金额'].sum() if overdue_contracts > 0 else 0
+
+    text = f"""截至{today_display}，{scope_label}存续追加保证金合同{int(cube['合同笔数'].sum())}笔，对应待执行量{smart_format_volume_zj(cube['调整后待执行数量'].sum() / 10000)}，{deposit_amount_str}"""
+    if prod_summary_str: text += f"。分品种看，{prod_summary_str}"
+    if overdue_contracts > 0: text += f"。其中，{overdue_contracts}笔合同已逾期，逾期金额{smart_format_money_zj(overdue_amount)}万元"
+    if trigger_str:
+        sep = "。" if overdue_contracts > 0 else "。其中，"
+        text += f"{sep}{trigger_str}"
+    return text
+
+def breakdown_lines_zj(cube, dim, blank_label=None):
+    """按大区/经营部分组的明细行，金额降序"""
+    groups = rollup_zj(cube, dim)
+    groups = groups.assign(_k=sort_key_zj(groups['调整后待追加保证金金额'])).sort_values('_k', kind='stable')
+    names = groups[dim].astype(str)
+    if blank_label: names = names.where(groups[dim] != "", blank_label)
+    seq = pd.Series(range(1, len(groups) + 1), index=groups.index).astype(str)
+    lines = (seq + "、" + names + "：" + groups['合同笔数'].astype(str) + "笔，待执行数量" + format_volume_series_zj(groups['调整后待执行数量'] / 10000)
+             + "，需追加保证金金额" + format_money_series_zj(groups['调整后待追加保证金金额']) + "万元。")
+    return "\n".join(lines)
+
+def customer_lines_zj(cube, group_dim, skip_blank_groups):
+    """分客户明细行：最长逾期、笔数、待执行量依次降序"""
+    cust = rollup_zj(cube, '客户名称')
+    cust = cust[cust['客户名称'] != ""]
+    max_od = cust['逾期天数'].fillna(0) if '逾期天数' in cust else pd.Series(0, index=cust.index)
+    cust = cust.assign(_od=max_od, _k1=-max_od, _k2=-cust['合同笔数'], _k3=sort_key_zj(cust['调整后待执行数量'] / 10000))
+    cust = cust.sort_values(['_k1', '_k2', '_k3'], kind='stable')
+    empty = pd.Series("", index=cust['客户名称'])
+    groups = ordered_labels_zj(cube, '客户名称', group_dim, skip_blank_groups) if group_dim in cube else empty
+    d_types = ordered_labels_zj(cube, '客户名称', '保证金类型', True) if '保证金类型' in cube else empty
+    names = cust['客户名称'].astype(object)
+    group_str = names.map(groups).fillna("").astype(str)
+    dt_str = names.map(d_types).fillna("").astype(str)
+    dt_str = (dt_str + "，").where(dt_str != "", "")
+    od_s = ("，最长逾期" + cust['_od'].round().astype('int64').astype(str) + "天").where(cust['_od'] > 0, "")
+    seq = pd.Series(range(1, len(cust) + 1), index=cust.index).astype(str)
+    prefix = seq + "、" + group_str + "："
+    if skip_blank_groups: prefix = prefix.where(group_str != "", seq + "、")
+    lines = (prefix + cust['合同笔数'].astype(str) + "笔，" + cust['客户名称'].astype(str) + "，" + dt_str + "待执行数量" + format_volume_series_zj(cust['调整后待执行数量'] / 10000)
+             + "，需追加保证金金额" + format_thousands_series_zj(cust['调整后待追加保证金金额']) + "万元" + od_s + "。")
+    return "\n".join(lines)
+
+def customer_header_zj(cube, scope_label, today_display):
+    total_am_fmt = format_number_with_thousands_zj(cube['调整后待追加保证金金额'].sum())
+    return f"截至{today_display}，{scope_label}存续追加保证金合同{int(cube['合同笔数'].sum())}笔，待执行数量{smart_format_volume_zj(cube['调整后待执行数量'].sum() / 10000)}，需追加保证金金额{total_am_fmt}万元。"
+
+def generate_analysis_report_zj(cube, today_display):
+    try:
+        missing = cube_missing_zj(cube, ('调整后待执行数量', '调整后待追加保证金金额'))
+        if missing: return f"分析报告生成失败：{missing}。"
+        region_summary_str = breakdown_lines_zj(cube, '大区') if '大区' in cube else ""
+        return overview_text_zj(cube, "", today_display, overdue_needs_trigger=True) + f"。分大区情况如下：\n{region_summary_str}"
     except: return "分析报告生成失败。"
 
-def generate_customer_analysis_report_zj(df_processed, today_display):
+def generate_customer_analysis_report_zj(cube, today_display):
     try:
-        c_col = b_col = exec_qty_col = am_col = an_col = deposit_type_col = None
-        for col_name in df_processed.columns:
-            col_str = str(col_name)
-            if '客户' in col_str and '名称' in col_str: c_col = col_name
-            elif '大区' in col_str and '玉米中心' not in col_str: b_col = col_name
-            elif '调整后待执行数量' in col_str: exec_qty_col = col_name
-            elif '调整后待追加保证金金额' in col_str: am_col = col_name
-            elif '逾期' in col_str and '天' in col_str: an_col = col_name
-            elif '保证金类型' in col_str: deposit_type_col = col_name
-
-        if not c_col or not am_col: return "客户分析报告生成失败：缺少必要的列数据。"
-
-        df_processed[exec_qty_col] = pd.to_numeric(df_processed[exec_qty_col], errors='coerce')
-        df_processed[am_col] = pd.to_numeric(df_processed[am_col], errors='coerce')
-        if an_col: df_processed[an_col] = pd.to_numeric(df_processed[an_col], errors='coerce')
-
-        total_am_fmt = format_number_with_thousands_zj(df_processed[am_col].sum())
-        report_header = f"截至{today_display}，存续追加保证金合同{len(df_processed)}笔，待执行数量{smart_format_volume_zj(df_processed[exec_qty_col].sum()/10000)}，需追加保证金金额{total_am_fmt}万元。"
-
-        c_data = []
-        for customer, group in df_processed.groupby(c_col):
-            if pd.isna(customer) or customer == "": continue
-            regions_str = "、".join([str(r) for r in (group[b_col].dropna().unique() if b_col else []) if pd.notna(r)])
-            d_types = ""
-            if deposit_type_col:
-                dt = group[deposit_type_col].dropna().unique()
-                dt_str = "、".join([str(d) for d in dt if pd.notna(d) and str(d).strip() != ""])
-                if dt_str: d_types = f"{dt_str}，"
-            max_od = group[an_col].max() if an_col else 0
-            if pd.isna(max_od): max_od = 0
-            
-            c_data.append({
-                'customer': customer, 'regions': regions_str, 'contracts': len(group),
-                'exec_qty': group[exec_qty_col].sum()/10000, 'am_amount': group[am_col].sum(),
-                'max_overdue': max_od, 'am_fmt': format_number_with_thousands_zj(group[am_col].sum()),
-                'max_od_str': str(round(max_od)), 'd_types': d_types
-            })
-
-        c_data.sort(key=lambda x: (-x['max_overdue'], -x['contracts'], -x['exec_qty']))
-        c_summary = []
-        for i, info in enumerate(c_data, 1):
-            od_s = f"，最长逾期{info['max_od_str']}天" if info['max_overdue'] > 0 else ""
-            line = f"{i}、{info['regions']}：{info['contracts']}笔，{info['customer']}，{info['d_types']}待执行数量{smart_format_volume_zj(info['exec_qty'])}，需追加保证金金额{info['am_fmt']}万元{od_s}。"
-            c_summary.append(line)
-        return f"{report_header}\n\n分客户情况如下：\n{'\n'.join(c_summary)}"
+        missing = cube_missing_zj(cube, ('客户名称', '调整后待执行数量', '调整后待追加保证金金额'))
+        if missing: return f"客户分析报告生成失败：{missing}。"
+        return f"{customer_header_zj(cube, '', today_display)}\n\n分客户情况如下：\n{customer_lines_zj(cube, '大区', False)}"
     except: return "客户分析报告生成失败。"
 
-def generate_region_department_report_zj(df_region, today_display, region_name):
+def generate_region_department_report_zj(cube, today_display, region_name):
     try:
-        exec_qty_col = am_col = d_col = trigger_date_col = an_col = dept_col = deposit_type_col = None
-        for col_name in df_region.columns:
-            col_str = str(col_name)
-            if '调整后待执行数量' in col_str: exec_qty_col = col_name
-            elif '调整后待追加保证金金额' in col_str: am_col = col_name
-            elif '细分品种' in col_str: d_col = col_name
-            elif ('追加保证金触发日期' in col_str or '触发日期' in col_str) and '到期' not in col_str: trigger_date_col = col_name
-            elif '逾期' in col_str and '天' in col_str: an_col = col_name
-            elif '经营部' in col_str: dept_col = col_name
-            elif '保证金类型' in col_str: deposit_type_col = col_name
-
-        if not exec_qty_col or not am_col: return f"{region_name}大区报告生成失败：缺少必要列数据。"
-
-        df_region[exec_qty_col] = pd.to_numeric(df_region[exec_qty_col], errors='coerce')
-        df_region[am_col] = pd.to_numeric(df_region[am_col], errors='coerce')
-        if an_col: df_region[an_col] = pd.to_numeric(df_region[an_col], errors='coerce')
-        if trigger_date_col: df_region[trigger_date_col] = pd.to_datetime(df_region[trigger_date_col], errors='coerce')
-
-        total_exec_qty = df_region[exec_qty_col].sum() / 10000
-        total_am_amount = df_region[am_col].sum()
-
-        deposit_amount_parts = []
-        if deposit_type_col:
-            df_region[deposit_type_col] = df_region[deposit_type_col].astype(str)
-            down_deposit = df_region[df_region[deposit_type_col].str.contains('跌价', na=False)][am_col].sum()
-            up_deposit = df_region[df_region[deposit_type_col].str.contains('涨价', na=False)][am_col].sum()
-            if down_deposit > 0.000001: deposit_amount_parts.append(f"应收取跌价保证金{smart_format_money_zj(down_deposit)}万元")
-            if up_deposit > 0.000001: deposit_amount_parts.append(f"应收取涨价保证金{smart_format_money_zj(up_deposit)}万元")
-            if not deposit_amount_parts: deposit_amount_str = f"应收取追加保证金{smart_format_money_zj(total_am_amount)}万元"
-            else: deposit_amount_str = "、".join(deposit_amount_parts)
-        else: deposit_amount_str = f"应收取追加保证金{smart_format_money_zj(total_am_amount)}万元"
-
-        prod_summary_str = ""
-        if d_col:
-            prods = []
-            for p, g in df_region.groupby(d_col):
-                amt = g[am_col].sum()
-                if amt > 0.000001: prods.append(f"{p}{smart_format_money_zj(amt)}万元")
-            prod_summary_str = "，".join(prods)
-
-        trigger_str = ""
-        if trigger_date_col:
-            t_sums = []
-            df_sorted = df_region.sort_values(by=trigger_date_col)
-            for date, group in df_sorted.groupby(trigger_date_col):
-                if pd.notnull(date):
-                    d_amt = group[am_col].sum()
-                    o_str = ""
-                    if an_col:
-                        od = group[an_col].dropna()
-                        if not od.empty and od.max() > 0: o_str = f"（逾期{int(od.max())}天）"
-                    if d_amt > 0.000001: t_sums.append(f"{smart_format_date_zj(date)}触发{smart_format_money_zj(d_amt)}万元{o_str}")
-            trigger_str = "，".join(t_sums)
-
-        overdue_contracts = 0
-        overdue_amount = 0
-        if an_col:
-            mask = df_region[an_col] > 0
-            overdue_contracts = mask.sum()
-            if overdue_contracts > 0: overdue_amount = df_region.loc[mask, am_col].sum()
-
-        dept_str = ""
-        if dept_col:
-            d_data = []
-            for dept, group in df_region.groupby(dept_col):
-                d_data.append({'dept': dept, 'contracts': len(group), 'exec_qty': group[exec_qty_col].sum()/10000, 'am_amount': group[am_col].sum()})
-            d_data.sort(key=lambda x: x['am_amount'], reverse=True)
-            d_lines = []
-            for i, d in enumerate(d_data, 1):
-                name = d['dept'] if pd.notna(d['dept']) and d['dept'] != "" else "未知经营部"
-                d_lines.append(f"{i}、{name}：{d['contracts']}笔，待执行数量{smart_format_volume_zj(d['exec_qty'])}，需追加保证金金额{smart_format_money_zj(d['am_amount'])}万元。")
-            dept_str = "\n".join(d_lines)
-
-        report_base = f"""截至{today_display}，{region_name}存续追加保证金合同{len(df_region)}笔，对应待执行量{smart_format_volume_zj(total_exec_qty)}，{deposit_amount_str}"""
-        if prod_summary_str: report_base += f"。分品种看，{prod_summary_str}"
-        if overdue_contracts > 0: report_base += f"。其中，{overdue_contracts}笔合同已逾期，逾期金额{smart_format_money_zj(overdue_amount)}万元"
-        if trigger_str:
-            sep = "。" if overdue_contracts > 0 else "。其中，"
-            report_base += f"{sep}{trigger_str}"
-        return report_base + f"。分经营部情况如下：\n{dept_str}"
+        missing = cube_missing_zj(cube, ('调整后待执行数量', '调整后待追加保证金金额'))
+        if missing: return f"{region_name}大区报告生成失败：{missing}。"
+        dept_str = breakdown_lines_zj(cube, '经营部', "未知经营部") if '经营部' in cube else ""
+        return overview_text_zj(cube, region_name, today_display) + f"。分经营部情况如下：\n{dept_str}"
     except: return f"{region_name}大区报告生成失败。"
 
-def generate_region_customer_report_zj(df_region, today_display, region_name):
+def generate_region_customer_report_zj(cube, today_display, region_name):
     try:
-        c_col = exec_qty_col = am_col = an_col = dept_col = deposit_type_col = None
-        for col_name in df_region.columns:
-            col_str = str(col_name)
-            if '客户' in col_str and '名称' in col_str: c_col = col_name
-            elif '调整后待执行数量' in col_str: exec_qty_col = col_name
-            elif '调整后待追加保证金金额' in col_str: am_col = col_name
-            elif '逾期' in col_str and '天' in col_str: an_col = col_name
-            elif '经营部' in col_str: dept_col = col_name
-            elif '保证金类型' in col_str: deposit_type_col = col_name
-
-        if not c_col or not am_col: return f"{region_name}大区客户分析报告生成失败。"
-
-        df_region[exec_qty_col] = pd.to_numeric(df_region[exec_qty_col], errors='coerce')
-        df_region[am_col] = pd.to_numeric(df_region[am_col], errors='coerce')
-        if an_col: df_region[an_col] = pd.to_numeric(df_region[an_col], errors='coerce')
-
-        total_am_fmt = format_number_with_thousands_zj(df_region[am_col].sum())
-        report_header = f"截至{today_display}，{region_name}存续追加保证金合同{len(df_region)}笔，待执行数量{smart_format_volume_zj(df_region[exec_qty_col].sum()/10000)}，需追加保证金金额{total_am_fmt}万元。"
-
-        c_data = []
-        for customer, group in df_region.groupby(c_col):
-            if pd.isna(customer) or customer == "": continue
-            depts_str = ""
-            if dept_col:
-                depts = group[dept_col].dropna().unique()
-                depts_str = "、".join([str(d) for d in depts if pd.notna(d) and str(d).strip() != ""])
-            d_types_str = ""
-            if deposit_type_col:
-                dt = group[deposit_type_col].dropna().unique()
-                t_str = "、".join([str(t) for t in dt if pd.notna(t) and str(t).strip() != ""])
-                if t_str: d_types_str = f"{t_str}，"
-            max_od = group[an_col].max() if an_col else 0
-            if pd.isna(max_od): max_od = 0
-            c_data.append({
-                'customer': customer, 'depts': depts_str, 'contracts': len(group),
-                'exec_qty': group[exec_qty_col].sum()/10000, 'am_amount': group[am_col].sum(),
-                'max_overdue': max_od, 'am_fmt': format_number_with_thousands_zj(group[am_col].sum()),
-                'max_od_str': str(round(max_od)), 'd_types': d_types_str
-            })
-
-        c_data.sort(key=lambda x: (-x['max_overdue'], -x['contracts'], -x['exec_qty']))
-        lines = []
-        for i, info in enumerate(c_data, 1):
-            od_s = f"，最长逾期{info['max_od_str']}天" if info['max_overdue'] > 0 else ""
-            prefix = f"{i}、{info['depts']}：" if info['depts'] else f"{i}、"
-            lines.append(f"{prefix}{info['contracts']}笔，{info['customer']}，{info['d_types']}待执行数量{smart_format_volume_zj(info['exec_qty'])}，需追加保证金金额{info['am_fmt']}万元{od_s}。")
-        return f"{report_header}\n\n分客户情况如下：\n{'\n'.join(lines)}"
+        missing = cube_missing_zj(cube, ('客户名称', '调整后待执行数量', '调整后待追加保证金金额'))
+        if missing: return f"{region_name}大区客户分析报告生成失败：{missing}。"
+        return f"{customer_header_zj(cube, region_name, today_display)}\n\n分客户情况如下：\n{customer_lines_zj(cube, '经营部', True)}"
     except: return f"{region_name}大区客户分析报告生成失败。"
 
-def process_additional_margin_logic(uploaded_file, region_filter):
+REGION_SCOPES_ZJ = ["中粮贸易", "沿海大区", "沿江大区", "内陆大区", "东北大区"]
+
+def load_filtered_margin_book_zj(uploaded_file, logs, minimal_output=False):
+    """
+    加载并筛选原表，写出『追保处理』；返回 (book, 立方体)，筛选后无数据时立方体为 None
+    minimal_output: 只读加载源表，输出只含派生 sheet 的只写工作簿，不再整本保存原表
+    """
+    if minimal_output:
+        source = openpyxl.load_workbook(uploaded_file, read_only=True)
+        book = openpyxl.Workbook(write_only=True)
+        try: df_processed, _, rule_counts = apply_excel_like_filtering_zj(source.worksheets[0], book.create_sheet('追保处理'), logs)
+        finally: source.close()
+    else:
+        # 分析用数据走只读流式读取，带样式的完整加载只用于复制保留行与整本输出
+        frame = load_margin_frame_zj(uploaded_file, logs)
+        book = openpyxl.load_workbook(uploaded_file)
+        ws_original = book.worksheets[0]
+        if '追保处理' in book.sheetnames: del book['追保处理']
+        ws_processed = book.create_sheet('追保处理')
+        df_processed, _, rule_counts = apply_excel_like_filtering_zj(ws_original, ws_processed, logs, frame)
+    if rule_counts: logs.append("🧹 筛选剔除：" + "，".join(f"{k} {v} 行" for k, v in rule_counts.items()))
+    if df_processed.empty: return book, None
+    # 列角色只解析一次，定型、聚合成立方体后供各报告只读共用
+    typed = typed_margin_frame_zj(df_processed, resolve_column_roles_zj(df_processed.columns))
+    return book, build_margin_cube_zj(typed)
+
+def scope_reports_zj(cube, scope, today_display):
+    """单个范围的 (报告A, 报告B, 错误提示)；中粮贸易为全公司，其余按大区切立方体"""
+    if scope == "中粮贸易":
+        return generate_analysis_report_zj(cube, today_display), generate_customer_analysis_report_zj(cube, today_display), ""
+    if '大区' not in cube: return "", "", "❌ 数据中找不到“大区”列，无法进行大区筛选。"
+    cube_region = cube[cube['大区'] == scope]
+    if len(cube_region) == 0: return "", "", f"⚠️ 筛选结果中没有包含【{scope}】的数据。"
+    return (generate_region_department_report_zj(cube_region, today_display, scope),
+            generate_region_customer_report_zj(cube_region, today_display, scope), "")
+
+def write_report_sheet_zj(book, title, report_A, report_B):
+    """报告 A/B 分列写入指定 sheet（已存在则重建）"""
+    if book.write_only: return stream_report_sheet_zj(book, title, report_A, report_B)
+    if title in book.sheetnames: del book[title]
+    ws_report = book.create_sheet(title)
+    ws_report.cell(row=1, column=1, value=report_A)
+    ws_report.cell(row=1, column=2, value=report_B)
+    ws_report.column_dimensions['A'].width = 100
+    ws_report.column_dimensions['B'].width = 100
+    for row in ws_report.iter_rows():
+        for cell in row:
+            if cell.value:
+                cell.alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
+                cell.font = Font(size=10, name='宋体')
+                ws_report.row_dimensions[cell.row].height = 200
+    ws_report.freeze_panes = 'A2'
+    return ws_report
+
+def stream_report_sheet_zj(book, title, report_A, report_B):
+    """只写工作簿版本的报告 sheet，格式与 write_report_sheet_zj 一致"""
+    ws_report = book.create_sheet(title)
+    ws_report.column_dimensions['A'].width = 100
+    ws_report.column_dimensions['B'].width = 100
+    ws_report.freeze_panes = 'A2'
+    cells = []
+    for text in (report_A, report_B):
+        cell = WriteOnlyCell(ws_report, value=text)
+        if text:
+            cell.alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
+            cell.font = Font(size=10, name='宋体')
+        cells.append(cell)
+    if report_A or report_B: ws_report.row_dimensions[1].height = 200
+    ws_report.append(cells)
+    return ws_report
+
+def save_book_zj(book):
+    output = io.BytesIO()
+    book.save(output)
+    output.seek(0)
+    return output
+
+def process_additional_margin_logic(uploaded_file, region_filter, minimal_output=False):
     """
     追加保证金处理核心逻辑
     region_filter: "中粮贸易" | "沿海大区" | "沿江大区" | "内陆大区" | "东北大区"
+    minimal_output: 只导出『追保处理』与『分析报告』两张 sheet
     """
     logs = []
     try:
         today_display = f"{datetime.now().month}月{datetime.now().day}日"
-        
-        # 1. 加载
-        book = openpyxl.load_workbook(uploaded_file)
-        ws_original = book.worksheets[0] 
-        
-        # 2. 筛选
-        if '追保处理' in book.sheetnames: del book['追保处理']
-        ws_processed = book.create_sheet('追保处理')
-        filtered_rows, column_names = apply_excel_like_filtering_zj(ws_original, ws_processed)
-        
-        if not filtered_rows:
-            return None, ["⚠️ 警告：筛选后没有数据行！"], "", ""
-
-        # 3. 准备数据
-        data_for_analysis = []
-        for _, row_data in filtered_rows:
-            row_dict = {}
-            for col_idx, value in enumerate(row_data, 1):
-                if col_idx in column_names:
-                    row_dict[column_names[col_idx]] = value
-            data_for_analysis.append(row_dict)
-        df_processed = pd.DataFrame(data_for_analysis)
-        
-        # 4. 报告生成逻辑 (按大区定制)
-        if '分析报告' in book.sheetnames: del book['分析报告']
-        ws_report = book.create_sheet('分析报告')
-        
-        # 找到大区列
-        b_col = next((c for c in df_processed.columns if '大区' in str(c) and '玉米中心' not in str(c)), None)
-        
-        report_A = ""
-        report_B = ""
-        
-        if region_filter == "中粮贸易":
-            # 生成总量报告
-            report_A = generate_analysis_report_zj(df_processed, today_display)
-            report_B = generate_customer_analysis_report_zj(df_processed, today_display)
-        else:
-            # 生成特定大区报告
-            if not b_col:
-                return None, [f"❌ 数据中找不到“大区”列，无法进行大区筛选。"], "", ""
-            
-            # 过滤 DataFrame
-            df_region = df_processed[df_processed[b_col] == region_filter].copy()
-            
-            if len(df_region) == 0:
-                return None, [f"⚠️ 筛选结果中没有包含【{region_filter}】的数据。"], "", ""
-            
-            report_A = generate_region_department_report_zj(df_region, today_display, region_filter)
-            report_B = generate_region_customer_report_zj(df_region, today_display, region_filter)
-
-        # 写入报告
-        ws_report.cell(row=1, column=1, value=report_A)
-        ws_report.cell(row=1, column=2, value=report_B)
-        
-        # 格式设置
-        ws_report.column_dimensions['A'].width = 100
-        ws_report.column_dimensions['B'].width = 100
-        for row in ws_report.iter_rows():
-            for cell in row:
-                if cell.value:
-                    cell.alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
-                    cell.font = Font(size=10, name='宋体')
-                    ws_report.row_dimensions[cell.row].height = 200
-        ws_report.freeze_panes = 'A2'
-
-        # 5. 导出
-        output = io.BytesIO()
-        book.save(output)
-        output.seek(0)
-        
+        book, cube = load_filtered_margin_book_zj(uploaded_file, logs, minimal_output)
+        if cube is None: return None, ["⚠️ 警告：筛选后没有数据行！"], "", ""
+
+        report_A, report_B, error = scope_reports_zj(cube, region_filter, today_display)
+        if error: return None, [error], "", ""
+        write_report_sheet_zj(book, '分析报告', report_A, report_B)
+
         logs.append(f"✅ 【{region_filter}】分析报告生成成功！")
-        return output, logs, report_A, report_B
+        return save_book_zj(book), logs, report_A, report_B
 
     except Exception as e:
         import traceback
         return None, [f"❌ 处理出错: {str(e)}", traceback.format_exc()], "", ""
+
+def process_all_regions_logic(uploaded_file, minimal_output=False):
+    """
+    一次解析筛选，生成全公司及四个大区的报告
+    返回 (工作簿, logs, {范围: (报告A, 报告B)})；每个范围一张『分析报告-范围』sheet，无数据的大区跳过
+    minimal_output: 只导出『追保处理』与各报告 sheet
+    """
+    logs = []
+    try:
+        today_display = f"{datetime.now().month}月{datetime.now().day}日"
+        book, cube = load_filtered_margin_book_zj(uploaded_file, logs, minimal_output)
+        if cube is None: return None, ["⚠️ 警告：筛选后没有数据行！"], {}
+
+        reports = {}
+        for scope in REGION_SCOPES_ZJ:
+            report_A, report_B, error = scope_reports_zj(cube, scope, today_display)
+            if error:
+                logs.append(error)
+                continue
+            write_report_sheet_zj(book, f'分析报告-{scope}', report_A, report_B)
+            reports[scope] = (report_A, report_B)
+
+        logs.append(f"✅ 共生成 {len(reports)} 个范围的分析报告！")
+        return save_book_zj(book), logs, reports
+
+    except Exception as e:
+        import traceback
+        return None, [f"❌ 处理出错: {str(e)}", traceback.format_exc()], {}
@@ -8,7 +8,13 @@ import platform
 import warnings
 import textwrap
 import openpyxl
+import numpy as np
+import pandas as pd
 from openpyxl.utils import range_boundaries, get_column_letter, column_index_from_string
+from openpyxl.worksheet.cell_range import CellRange
+from xml.etree import ElementTree
+from utils.header_detect import locate_by_coverage, text_has_keyword
+from utils.used_range import sheet_extent, declared_extent, extent_log
 
 from docx import Document
 from docx.shared import Pt
@@ -52,7 +58,60 @@ def clean_money(val):
     except:
         return 0.0
 
+def sheet_merged_ranges(ws):
+    """只读工作表不解析合并单元格，这里单独从该 sheet 的 XML 取出 <mergeCell ref>（行元素读完即释放）"""
+    ranges = []
+    with ws._get_source() as src:
+        for _, el in ElementTree.iterparse(src):
+            tag = el.tag.rsplit('}', 1)[-1]
+            if tag == 'mergeCell': ranges.append(CellRange(el.get('ref')))
+            elif tag == 'row': el.clear()
+    return ranges
+
+def row_cell(row, idx):
+    """按列序号(0起)取单元格，只读模式下行尾空单元格不存在时返回 None"""
+    return row[idx] if idx is not None and idx < len(row) else None
+
+def row_value(row, idx):
+    cell = row_cell(row, idx)
+    return cell.value if cell is not None else None
+
+OVERDUE_FIELDS = ("大区", "经营部", "客户名称", "合同号", "品种", "逾期天数", "逾期金额")
+
+def overdue_frame(sheet_rows, scope_ranges, col_map, exclude_regions):
+    """
+    各品种线范围内的行一次性抽成列式 DataFrame：scope / is_group / 各字段 / 组 / 组序
+    组标题行（有底色的大区行，大豆不分组）按 scope 向下填充得到各行所属组；组序为该组首个标题行的位置
+    """
+    scopes, rows = [], []
+    for kw, row_range in scope_ranges.items():
+        for r_idx in row_range:
+            scopes.append(kw)
+            rows.append(sheet_rows[r_idx - 1] if r_idx <= len(sheet_rows) else ())
+
+    raw = {k: [row_value(row, col_map.get(k)) for row in rows] for k in OVERDUE_FIELDS}
+    df = pd.DataFrame({k: [clean_value(v) for v in raw[k]] for k in OVERDUE_FIELDS if k != "逾期金额"}, dtype=object)
+    df["逾期天数"] = [v.replace('.0', '') for v in df["逾期天数"]]
+    df["逾期金额"] = np.array([clean_money(v) for v in raw["逾期金额"]], dtype=float)
+    df.insert(0, "scope", pd.Series(scopes, dtype=object))
+
+    region_idx = col_map.get("大区")
+    filled = np.array([get_cell_fill_color(row_cell(row, region_idx)) for row in rows], dtype=bool)
+    df.insert(1, "is_group", (df["scope"] != "大豆") & (df["大区"] != "") & ~df["大区"].isin(exclude_regions) & filled)
+
+    df["组"] = df["大区"].where(df["is_group"]).groupby(df["scope"]).ffill()
+    df.loc[df["scope"] == "大豆", "组"] = "ALL_SOYBEAN"
+    header_pos = pd.Series(np.arange(len(df)), index=df.index, dtype=float).where(df["is_group"])
+    df["组序"] = header_pos.groupby([df["scope"], df["组"]]).transform("min")
+    return df
+
+def overdue_line(j, row):
+    return (f"{j+1}、{row['大区']}，{row['经营部']}，{row['客户名称']}，"
+            f"{row['合同号']}，{row['品种']}，逾期{row['逾期天数']}天，"
+            f"{int(row['逾期金额'])}万元；")
+
 def get_cell_fill_color(cell):
+    if cell is None: return False
     if cell.fill and cell.fill.start_color:
         color = cell.fill.start_color
         if not color.index or color.index == '00000000':
@@ -72,31 +131,33 @@ def generate_word_in_memory(file_stream):
     logs = []
     report_text_dict = {} 
     
+    # 只读模式只解析目标 sheet：单元格值与样式 ID 一次读入，合并区域单独从 XML 取
+    target_sheet_name = "每日-各品种线战略客户逾期通报"
     try:
         file_stream.seek(0)
-        wb = openpyxl.load_workbook(file_stream, data_only=True)
+        wb = openpyxl.load_workbook(file_stream, read_only=True, data_only=True)
     except Exception as e:
         return None, {}, [f"❌ 读取 Excel 文件失败: {e}"]
-
-    target_sheet_name = "每日-各品种线战略客户逾期通报"
-    if target_sheet_name not in wb.sheetnames:
-        return None, {}, [f"❌ 未找到关键工作表: {target_sheet_name}"]
-    
-    ws = wb[target_sheet_name]
-    
-    header_row_idx = None
-    col_map = {}
-    required_cols = ["品种线", "大区", "经营部", "客户名称", "合同号", "品种", "逾期天数", "逾期金额"]
-    
-    for r in range(1, 21):
-        row_values = [clean_value(c.value) for c in ws[r]]
-        matches = sum(1 for k in required_cols if any(k in v for v in row_values))
-        if matches >= 4:
-            header_row_idx = r
-            for idx, val in enumerate(row_values):
-                for k in required_cols:
-                    if k in val: col_map[k] = idx
-            break
+    try:
+        if target_sheet_name not in wb.sheetnames:
+            return None, {}, [f"❌ 未找到关键工作表: {target_sheet_name}"]
+        ws = wb[target_sheet_name]
+        ws.reset_dimensions()
+        sheet_rows = [tuple(r) for r in ws.iter_rows()]
+        merged_ranges = sheet_merged_ranges(ws)
+        return build_word_report(sheet_rows, merged_ranges, logs, report_text_dict)
+    finally:
+        wb.close()
+
+def build_word_report(sheet_rows, merged_ranges, logs, report_text_dict):
+    """由目标 sheet 的单元格行与合并区域生成 Word 报告"""
+    def cell_value(r, c):
+        row = sheet_rows[r - 1] if 0 < r <= len(sheet_rows) else ()
+        cell = row_cell(row, c - 1)
+        return cell.value if cell is not None else None
+
+    # 前 20 行中首个覆盖 ≥4 个必需列的行为标题行
+    header_row_idx, col_map = locate_by_coverage(([c.value for c in r] for r in sheet_rows[:20]), "credit_word", 4)
             
     if not header_row_idx:
         return None, {}, ["❌ 未找到标题行。"]
@@ -105,9 +166,9 @@ def generate_word_in_memory(file_stream):
     target_keywords = ["玉米", "粮谷", "大豆"] 
     p_col_idx = col_map.get("品种线")
     
-    for rng in ws.merged_cells.ranges:
+    for rng in merged_ranges:
         if rng.min_col <= (p_col_idx + 1) <= rng.max_col:
-            top_val = clean_value(ws.cell(row=rng.min_row, column=rng.min_col).value)
+            top_val = clean_value(cell_value(rng.min_row, rng.min_col))
             for kw in target_keywords:
                 if kw in top_val:
                     start_r = max(rng.min_row, header_row_idx + 1)
@@ -116,45 +177,10 @@ def generate_word_in_memory(file_stream):
                         scope_ranges[kw] = range(start_r, end_r + 1)
                     break
 
-    data_store = {}
     exclude_regions = ["东北大区", "内陆大区", "沿江大区", "沿海大区", "东北", "内陆", "沿江", "沿海"]
-
-    for kw, row_range in scope_ranges.items():
-        if kw not in data_store: data_store[kw] = {}
-        current_group = None
-        if kw == "大豆":
-            current_group = "ALL_SOYBEAN"
-            data_store[kw][current_group] = []
-        
-        for r_idx in row_range:
-            row = ws[r_idx]
-            def get_val(key):
-                idx = col_map.get(key)
-                return row[idx].value if idx is not None else None
-
-            region_str = clean_value(get_val("大区"))
-            client_name = clean_value(get_val("客户名称"))
-            
-            is_group = False
-            if kw != "大豆":
-                cell_region = row[col_map.get("大区")]
-                if region_str and (region_str not in exclude_regions) and get_cell_fill_color(cell_region):
-                    is_group = True
-            
-            if is_group:
-                current_group = region_str
-                if current_group not in data_store[kw]:
-                    data_store[kw][current_group] = []
-            elif current_group:
-                money_val = clean_money(get_val("逾期金额"))
-                if client_name and money_val > 0:
-                    data_store[kw][current_group].append({
-                        '大区': region_str, '经营部': clean_value(get_val("经营部")),
-                        '客户名称': client_name, '合同号': clean_value(get_val("合同号")),
-                        '品种': clean_value(get_val("品种")),
-                        '逾期天数': clean_value(get_val("逾期天数")).replace('.0', ''),
-                        '逾期金额': money_val
-                    })
+    df = overdue_frame(sheet_rows, scope_ranges, col_map, exclude_regions)
+    # 明细行：已归组、非标题行、有客户名且逾期金额 > 0
+    data = df[~df["is_group"] & df["组"].notna() & (df["客户名称"] != "") & (df["逾期金额"] > 0)]
 
     doc = Document()
     yesterday = datetime.datetime.now() - timedelta(days=1)
@@ -173,23 +199,10 @@ def generate_word_in_memory(file_stream):
     has_content = False
     
     for key in target_keywords:
-        if key not in data_store or not data_store[key]: continue
-        groups = data_store[key]
-
-        total_count = 0
-        total_money = 0
-        valid_groups_list = []
-        all_rows_flat = [] 
-
-        for g_name, rows in groups.items():
-            if len(rows) > 0:
-                g_total = sum(r['逾期金额'] for r in rows)
-                valid_groups_list.append({'name': g_name, 'rows': rows, 'total': g_total})
-                all_rows_flat.extend(rows)
-                total_count += len(rows)
-                total_money += g_total
-        
-        if total_count == 0: continue
+        key_rows = data[data["scope"] == key]
+        if key_rows.empty: continue
+        total_count = len(key_rows)
+        total_money = key_rows["逾期金额"].sum()
         has_content = True
         
         header_text = (f"按照公司领导要求，请{key}中心充分发挥与战略客户的良好沟通机制，"
@@ -205,32 +218,31 @@ def generate_word_in_memory(file_stream):
         center_text_block = f"【{key}中心】\n{header_text}\n"
 
         if key == "大豆":
-            all_rows_flat.sort(key=lambda r: r['逾期金额'], reverse=True)
-            for j, row in enumerate(all_rows_flat):
-                line = (f"{j+1}、{row['大区']}，{row['经营部']}，{row['客户名称']}，"
-                        f"{row['合同号']}，{row['品种']}，逾期{row['逾期天数']}天，"
-                        f"{int(row['逾期金额'])}万元；")
+            sorted_rows = key_rows.sort_values("逾期金额", ascending=False, kind="stable")
+            for j, row in enumerate(sorted_rows.to_dict("records")):
+                line = overdue_line(j, row)
                 p = doc.add_paragraph()
                 p.paragraph_format.first_line_indent = Pt(24)
                 set_font_style(p.add_run(line), font_name='宋体', size=12)
                 center_text_block += f"{line}\n"
         else:
-            valid_groups_list.sort(key=lambda x: x['total'], reverse=True)
-            for i, g_data in enumerate(valid_groups_list):
+            # 组按合计降序，同额保持标题行出现的先后
+            grouped = key_rows.groupby("组", sort=False)
+            summary = grouped.agg(笔数=("逾期金额", "size"), 合计=("逾期金额", "sum"), 组序=("组序", "first"))
+            summary = summary.sort_values(["合计", "组序"], ascending=[False, True], kind="stable")
+            for i, (g_name, g_data) in enumerate(summary.iterrows()):
                 idx_str = chinese_nums[i] if i < len(chinese_nums) else str(i+1)
-                group_line = (f"{idx_str}、{g_data['name']}，共计逾期{len(g_data['rows'])}笔，"
-                              f"逾期金额{int(g_data['total'])}万元。")
+                group_line = (f"{idx_str}、{g_name}，共计逾期{int(g_data['笔数'])}笔，"
+                              f"逾期金额{int(g_data['合计'])}万元。")
                 
                 p = doc.add_paragraph()
                 p.paragraph_format.first_line_indent = Pt(24)
                 set_font_style(p.add_run(group_line), font_name='黑体', size=12, bold=True)
                 center_text_block += f"{group_line}\n"
                 
-                sorted_rows = sorted(g_data['rows'], key=lambda r: r['逾期金额'], reverse=True)
-                for j, row in enumerate(sorted_rows):
-                    line = (f"{j+1}、{row['大区']}，{row['经营部']}，{row['客户名称']}，"
-                            f"{row['合同号']}，{row['品种']}，逾期{row['逾期天数']}天，"
-                            f"{int(row['逾期金额'])}万元；")
+                sorted_rows = grouped.get_group(g_name).sort_values("逾期金额", ascending=False, kind="stable")
+                for j, row in enumerate(sorted_rows.to_dict("records")):
+                    line = overdue_line(j, row)
                     p = doc.add_paragraph()
                     p.paragraph_format.first_line_indent = Pt(24)
                     set_font_style(p.add_run(line), font_name='宋体', size=12)
@@ -372,7 +384,7 @@ def render_sheet_range_to_image_stream(ws, range_str):
         row_vals = [str(ws.cell(row=r, column=c).value or "").strip() for c in valid_cols]
         combined = "".join(row_vals)
         
-        if "序号" in combined or "业务单位" in combined or "大区" in combined:
+        if text_has_keyword(combined, "credit_image"):
             header_start_row = r
             break
 
@@ -679,10 +691,14 @@ def generate_export_files_in_memory(file_stream):
                 if sheet_name in wb_data.sheetnames and sheet_name in wb_formula.sheetnames:
                     ws_d = wb_data[sheet_name]
                     ws_f = wb_formula[sheet_name]
+                    # 公式只可能出现在有值的单元格里，按公式表的有效范围限界
+                    last_row, last_col = sheet_extent(ws_f)
+                    extent_msg = extent_log(sheet_name, declared_extent(ws_f), (last_row, last_col))
+                    if extent_msg: logs.append(f"   {extent_msg}")
                     
                     for _ in range(2): 
-                        for r in range(1, ws_f.max_row + 1):
-                            for c in range(1, ws_f.max_column + 1):
+                        for r in range(1, last_row + 1):
+                            for c in range(1, last_col + 1):
                                 f_cell = ws_f.cell(row=r, column=c)
                                 d_cell = ws_d.cell(row=r, column=c)
                                 
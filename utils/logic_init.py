@@ -1,78 +1,132 @@
 import pandas as pd
+import numpy as np
 import io
+import glob
+import re
+import os
+import sqlite3
+import weakref
 import copy
 import math
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 import openpyxl
-from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.formatting.rule import FormulaRule
+from utils.header_detect import locate_by_priority
+from utils.used_range import read_bounded_rows, sheet_extent, extent_log
 
 # ============================================================================
 # PART 1: 初始保证金处理逻辑 (XSchushi.txt / app.py 原有逻辑)
 # ============================================================================
 
-def read_excel_safe(file_stream):
+def locate_header_index(rows, max_search_rows=200, max_search_cols=20):
+    """标题行在 rows 中的下标：优先含合同编号的行，其次含业务部门的行，均无则为 0"""
+    row = locate_by_priority(rows, "margin_init", max_search_rows, max_search_cols)
+    return row - 1 if row else 0
+
+def rows_to_frame(rows, header_idx):
+    header = rows[header_idx] if header_idx < len(rows) else ()
+    columns, seen = [], {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None or str(name).strip() == "" else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else: seen[name] = 0
+        columns.append(name)
+    width = len(columns)
+    data = [tuple(r[:width]) + (None,) * (width - len(r)) for r in rows[header_idx + 1:]]
+    while data and all(v is None for v in data[-1]): data.pop()
+    df = pd.DataFrame(data, columns=columns).replace({None: np.nan})
+    if '合同编号' in df.columns:
+        cid = df['合同编号']
+        df['合同编号'] = cid.where(cid.isna(), cid.astype(str))
+    return df
+
+def read_sheet_frame(worksheet, logs=None):
+    """
+    单次流式读取工作表，按标题行偏移跳过表头前的说明行，返回 (标题行号, DataFrame)
+    只读有效数据范围；传入 logs 时，声明范围虚大会记一条日志
+    """
+    rows, declared, used = read_bounded_rows(worksheet)
+    message = extent_log(worksheet.title, declared, used)
+    if logs is not None and message: logs.append(message)
+    header_idx = locate_header_index(rows)
+    return header_idx + 1, rows_to_frame(rows, header_idx)
+
+def read_margin_snapshot(source, logs=None):
+    """只读解析 WSBZJQKB（公式单元格取缓存值），返回 (标题行号, DataFrame)；source 为路径或文件流"""
+    if hasattr(source, "seek"): source.seek(0)
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
     try:
-        file_stream.seek(0)
-        df = pd.read_excel(file_stream, sheet_name="WSBZJQKB", dtype={'合同编号': str})
-        if '合同编号' not in df.columns:
-            file_stream.seek(0)
-            df_temp = pd.read_excel(file_stream, sheet_name="WSBZJQKB", header=None, nrows=200)
-            header_idx = -1
-            for idx, row in df_temp.iterrows():
-                if "合同编号" in row.values:
-                    header_idx = idx
-                    break
-            if header_idx != -1:
-                file_stream.seek(0)
-                df = pd.read_excel(file_stream, sheet_name="WSBZJQKB", header=header_idx, dtype={'合同编号': str})
-            else:
-                raise ValueError("在文件前200行中无法找到包含'合同编号'的标题行，请检查文件格式。")
-        return df
-    except Exception as e:
-        raise e
+        if "WSBZJQKB" not in wb.sheetnames: raise ValueError("未找到工作表 WSBZJQKB，请检查文件格式。")
+        header_row, df = read_sheet_frame(wb["WSBZJQKB"], logs)
+    finally: wb.close()
+    if '合同编号' not in df.columns:
+        raise ValueError("在文件前200行中无法找到包含'合同编号'的标题行，请检查文件格式。")
+    return header_row, df
+
+def read_excel_safe(file_stream):
+    return read_margin_snapshot(file_stream)[1]
 
-def fill_original_sheet_columns(ws_original, df_data):
+def style_array(cell):
+    if not cell._style: cell._style = StyleArray()
+    return cell._style
+
+def fill_original_sheet_columns(ws_original, df_data, header_row=1, normalize_sheet=True):
+    """
+    将补全的原因写回原表：只写空白单元格，字体/填充/对齐/边框直接复用工作簿中已登记的样式 ID
+    normalize_sheet: 是否统一全表边框、垂直居中与行高
+    """
     try:
-        col_reason = get_column_by_name(ws_original, "逾期具体原因")
-        col_type = get_column_by_name(ws_original, "逾期原因分类")
-        col_client = get_column_by_name(ws_original, "客户")
+        wb = ws_original.parent
+        col_reason = get_column_by_name(ws_original, "逾期具体原因", header_row)
+        col_type = get_column_by_name(ws_original, "逾期原因分类", header_row)
+        col_client = get_column_by_name(ws_original, "客户", header_row)
         left_align = Alignment(horizontal='left', vertical='center', wrap_text=True)
         thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
                              top=Side(style='thin'), bottom=Side(style='thin'))
+        left_align_id = wb._alignments.add(left_align)
+        thin_border_id = wb._borders.add(thin_border)
+        last_row, last_col = sheet_extent(ws_original)
         if col_reason and col_type and col_client:
-            for i, row_cells in enumerate(ws_original.iter_rows(min_row=2), start=0):
-                if i >= len(df_data): break
-                cell_reason = row_cells[col_reason - 1]
-                cell_type = row_cells[col_type - 1]
-                cell_client = row_cells[col_client - 1]
-                new_reason_val = df_data.iloc[i].get("逾期具体原因_新", "")
-                new_type_val = df_data.iloc[i].get("逾期原因分类_新", "")
-                if cell_reason.value is None or str(cell_reason.value).strip() == "":
-                    cell_reason.value = new_reason_val
-                    if cell_client.has_style:
-                        cell_reason.font = copy.copy(cell_client.font)
-                        cell_reason.fill = copy.copy(cell_client.fill)
-                    cell_reason.alignment = left_align
-                    cell_reason.border = thin_border
-                if cell_type.value is None or str(cell_type.value).strip() == "":
-                    cell_type.value = new_type_val
-                    if cell_client.has_style:
-                        cell_type.font = copy.copy(cell_client.font)
-                        cell_type.fill = copy.copy(cell_client.fill)
-                    cell_type.alignment = left_align
-                    cell_type.border = thin_border
-        for row in ws_original.iter_rows():
-            ws_original.row_dimensions[row[0].row].height = 24.5
-            for cell in row:
-                cell.border = thin_border
-                if cell.alignment:
-                    new_align = copy.copy(cell.alignment)
-                    new_align.vertical = 'center'
-                    cell.alignment = new_align
+            n_rows = min(len(df_data), max(last_row - header_row, 0))
+            for col_idx, new_col in ((col_reason, "逾期具体原因_新"), (col_type, "逾期原因分类_新")):
+                new_vals = df_data[new_col].to_numpy() if new_col in df_data.columns else np.full(len(df_data), "", dtype=object)
+                header = ws_original.cell(row=header_row, column=col_idx).value
+                if header is not None and str(header) in df_data.columns:
+                    blank = reason_text_column(df_data, str(header)).str.strip().to_numpy()[:n_rows] == ""
+                    blank_rows = np.flatnonzero(blank)
                 else:
-                    cell.alignment = Alignment(vertical='center')
+                    blank_rows = [i for i in range(n_rows)
+                                  if str(ws_original.cell(row=header_row + 1 + i, column=col_idx).value or "").strip() == ""]
+                for i in blank_rows:
+                    r = header_row + 1 + int(i)
+                    cell = ws_original.cell(row=r, column=col_idx)
+                    cell.value = new_vals[i]
+                    cell_client = ws_original.cell(row=r, column=col_client)
+                    style = style_array(cell)
+                    if cell_client.has_style:
+                        style.fontId = cell_client._style.fontId
+                        style.fillId = cell_client._style.fillId
+                    style.alignmentId = left_align_id
+                    style.borderId = thin_border_id
+        if normalize_sheet:
+            centered_ids = {}
+            for row in ws_original.iter_rows(min_row=header_row, max_row=max(last_row, header_row), max_col=last_col or 1):
+                ws_original.row_dimensions[row[0].row].height = 24.5
+                for cell in row:
+                    style = style_array(cell)
+                    style.borderId = thin_border_id
+                    new_id = centered_ids.get(style.alignmentId)
+                    if new_id is None:
+                        new_align = copy.copy(wb._alignments[style.alignmentId])
+                        new_align.vertical = 'center'
+                        new_id = centered_ids[style.alignmentId] = wb._alignments.add(new_align)
+                    style.alignmentId = new_id
     except Exception as e: pass
 
 def get_true_column_width(value):
@@ -113,42 +167,44 @@ def auto_fit_columns(worksheet, min_width=10, max_width=60):
         adjusted_width = min(max(max_length + 3, min_width), max_width)
         worksheet.column_dimensions[column_letter].width = adjusted_width
 
-def find_header_row(worksheet):
-    try:
-        max_search_rows = min(200, worksheet.max_row)
-        critical_field = "合同编号"
-        for row_idx in range(1, max_search_rows + 1):
-            row_values = []
-            for col_idx in range(1, min(20, worksheet.max_column) + 1):
-                cell_value = worksheet.cell(row_idx, col_idx).value
-                if cell_value: row_values.append(str(cell_value).strip())
-            for val in row_values:
-                if critical_field in val: return row_idx
-        for row_idx in range(1, max_search_rows + 1):
-            for col_idx in range(1, min(20, worksheet.max_column) + 1):
-                val = str(worksheet.cell(row_idx, col_idx).value or "")
-                if "业务部门" in val: return row_idx
-        return 1
-    except: return 1
-
-def remove_empty_rows(worksheet):
-    try:
-        header_row = find_header_row(worksheet)
-        if header_row > 1:
-            rows_to_delete = header_row - 1
-            worksheet.delete_rows(1, rows_to_delete)
-            return True
-        return True
-    except: return False
+# 每个工作表的标题行索引：首次查找时读取一次标题行，之后的列名（含子串/别名）查找结果直接复用
+_header_indexes = weakref.WeakKeyDictionary()
 
-def get_column_by_name(worksheet, column_names):
+def normalize_header(value):
+    return str(value).strip() if value else ""
+
+def header_index(worksheet, header_row=1):
+    """返回标题行索引，只在首次调用时读取一次标题行（不读 max_column，避免每次扫描全表）"""
+    per_sheet = _header_indexes.setdefault(worksheet, {})
+    entry = per_sheet.get(header_row)
+    if entry is None:
+        row = next(worksheet.iter_rows(min_row=header_row, max_row=header_row, values_only=True), ())
+        entry = per_sheet[header_row] = {'headers': [normalize_header(v) for v in row], 'lookups': {}}
+    return entry
+
+def invalidate_header_index(worksheet):
+    """插入/删除列或直接改写标题单元格后调用，丢弃该工作表的标题行索引"""
+    _header_indexes.pop(worksheet, None)
+
+def header_cell_matches(worksheet, header_row, entry, col):
+    """只读该列的一个标题单元格，核对索引是否仍与表一致"""
+    return normalize_header(worksheet.cell(row=header_row, column=col).value) == entry['headers'][col - 1]
+
+def find_header_column(entry, column_names):
+    return next((c for c, text in enumerate(entry['headers'], 1) if text and any(name in text for name in column_names)), None)
+
+def get_column_by_name(worksheet, column_names, header_row=1):
+    """未命中不缓存：未命中或命中列标题已变时重读一次标题行，插入/删除列后仍能找到"""
     if isinstance(column_names, str): column_names = [column_names]
-    for col in range(1, worksheet.max_column + 1):
-        cell_value = worksheet.cell(row=1, column=col).value
-        if cell_value:
-            for col_name in column_names:
-                if col_name in str(cell_value).strip(): return col
-    return None
+    key = tuple(column_names)
+    entry = header_index(worksheet, header_row)
+    col = entry['lookups'].get(key) or find_header_column(entry, column_names)
+    if col is None or not header_cell_matches(worksheet, header_row, entry, col):
+        invalidate_header_index(worksheet)
+        entry = header_index(worksheet, header_row)
+        col = find_header_column(entry, column_names)
+    if col is not None: entry['lookups'][key] = col
+    return col
 
 def beautify_sheet_common(ws, title_color="BDD7EE"):
     thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
@@ -157,16 +213,17 @@ def beautify_sheet_common(ws, title_color="BDD7EE"):
     header_font = Font(color="000000", bold=True, size=11)
     light_fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
     white_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    for col in range(1, ws.max_column + 1):
+    last_row, last_col = sheet_extent(ws)
+    for col in range(1, last_col + 1):
         cell = ws.cell(row=1, column=col)
         cell.fill = header_fill
         cell.font = header_font
         cell.border = thin_border
         cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
     center_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
-    for row in range(2, ws.max_row + 1):
+    for row in range(2, last_row + 1):
         row_bg_fill = white_fill if row % 2 == 0 else light_fill
-        for col in range(1, ws.max_column + 1):
+        for col in range(1, last_col + 1):
             cell = ws.cell(row=row, column=col)
             cell.border = thin_border
             current_fill = cell.fill
@@ -177,85 +234,108 @@ def beautify_sheet_common(ws, title_color="BDD7EE"):
             if not cell.font.color or cell.font.color.rgb == "00000000": cell.font = Font(size=10)
             cell.alignment = center_align
     ws.row_dimensions[1].height = 25
-    for row in range(2, ws.max_row + 1): ws.row_dimensions[row].height = 22
+    for row in range(2, last_row + 1): ws.row_dimensions[row].height = 22
     ws.freeze_panes = 'A2'
 
-def clean_and_organize_A_sheet(ws_A):
+A_SHEET_DROP_COLUMNS = ["区域公司", "公司名称", "销售类型", "业务模式", "合同提交日期", "合同签订日期", "合同生效日期", "出库数量", "是否约定保证金条款", "合同约定几个工作日收取", "已收货款金额（不含保证金）", "逾期具体原因", "逾期原因分类", "逾期具体原因_新", "逾期原因分类_新"]
+DEPT_NAME_NOISE = ['沿海深圳', '食品原料部', '经营部', '中粮贸易（深圳）有限公司-', '（旧）']
+
+def build_A_frame(df_A):
+    """A类逾期明细的列裁剪、日期规范、排序与部门名清洗，全部在 DataFrame 上一次完成"""
+    keep_cols = [c for c in df_A.columns if not any(t in str(c) for t in A_SHEET_DROP_COLUMNS)]
+    df = df_A.loc[:, keep_cols].copy()
+    date_col = next((c for c in df.columns if "应收保证金日期" in str(c)), None)
+    if date_col:
+        df[date_col] = pd.to_datetime(df[date_col], errors='coerce').dt.strftime('%Y-%m-%d')
+        df = df.sort_values(by=date_col)
+    dept_col = next((c for c in df.columns if "业务部门" in str(c)), None)
+    if dept_col:
+        dept = df[dept_col]
+        noise = "|".join(re.escape(r) for r in DEPT_NAME_NOISE)
+        df[dept_col] = dept.astype(str).str.replace(noise, '', regex=True).where(dept.notna())
+    return df.astype(object).where(df.notna(), None)
+
+A_NUMBER_FORMATS = {"合同数量": '0.00', "合同单价": '0.00', "合同金额": '0.00', "应收保证金金额": '0.00', "已收定金": '0.00', "逾期初始保证金": '0.00', "应收保证金比例": '0%'}
+
+def coerce_A_numeric(df_A):
+    """数值/比例列统一用 pd.to_numeric 转为 float；无法识别的值保留原样，返回 (DataFrame, {列名: 无法识别的值列表})"""
+    df = df_A.copy()
+    unparsable = {}
+    for col_name in A_NUMBER_FORMATS:
+        col = next((c for c in df.columns if col_name in str(c)), None)
+        if col is None: continue
+        raw = df[col]
+        num = pd.to_numeric(raw, errors='coerce').astype(float)
+        bad = raw.notna() & num.isna() & (raw.astype(str).str.strip() != "")
+        if bad.any(): unparsable[col] = raw[bad].astype(str).tolist()
+        df[col] = num.astype(object).where(num.notna(), raw)
+    return df, unparsable
+
+def A_row_flags(df_A, as_of):
+    """按明确的截止日期计算每行是否到期 (due: 日期 <= as_of) 与是否逾期 (overdue: 日期 < as_of)"""
+    date_col = next((c for c in df_A.columns if "应收保证金日期" in str(c)), None)
+    if not date_col: return pd.DataFrame({'due': False, 'overdue': False}, index=df_A.index)
+    dates = pd.to_datetime(df_A[date_col], errors='coerce').dt.normalize()
+    as_of_ts = pd.Timestamp(as_of)
+    return pd.DataFrame({'due': dates <= as_of_ts, 'overdue': dates < as_of_ts}, index=df_A.index)
+
+def clean_and_organize_A_sheet(ws_A, df, serial_mode="running"):
+    """
+    serial_mode: 序号列的可见行编号方式
+        "running"  每行 = 上一行序号 + SUBTOTAL(103, 本行合同编号)，筛选后仍连续编号，计算量随行数线性增长
+        "subtotal" 每行 = SUBTOTAL(103, $X$2:Xr)，逐行统计到当前行，计算量随行数平方增长
+    """
     try:
-        columns_to_delete = ["区域公司", "公司名称", "销售类型", "业务模式", "合同提交日期", "合同签订日期", "合同生效日期", "出库数量", "是否约定保证金条款", "合同约定几个工作日收取", "已收货款金额（不含保证金）", "逾期具体原因", "逾期原因分类", "逾期具体原因_新", "逾期原因分类_新"]
-        cols_found = []
-        for col in range(1, ws_A.max_column + 1):
-            val = str(ws_A.cell(row=1, column=col).value)
-            for target in columns_to_delete:
-                if target in val:
-                    cols_found.append(col)
-                    break
-        for col_idx in sorted(cols_found, reverse=True): ws_A.delete_cols(col_idx, 1)
-        data = list(ws_A.values)
-        if not data: return False
-        headers = data[0]
-        df = pd.DataFrame(data[1:], columns=headers)
-        date_col = next((c for c in df.columns if "应收保证金日期" in str(c)), None)
-        if date_col:
-            df[date_col] = pd.to_datetime(df[date_col], errors='coerce').dt.strftime('%Y-%m-%d')
-            df = df.sort_values(by=date_col)
-        dept_col = next((c for c in df.columns if "业务部门" in str(c)), None)
-        if dept_col:
-            replacements = ['沿海深圳', '食品原料部', '经营部', '中粮贸易（深圳）有限公司-', '（旧）']
-            for r in replacements: df[dept_col] = df[dept_col].astype(str).str.replace(r, '', regex=False)
-        ws_A.delete_rows(2, ws_A.max_row)
-        for r_idx, row in enumerate(df.values, 2):
-            for c_idx, val in enumerate(row, 1): ws_A.cell(row=r_idx, column=c_idx, value=val)
+        ws_A.append([str(c) for c in df.columns])
+        for row in df.itertuples(index=False, name=None): ws_A.append(row)
         serial_col = get_column_by_name(ws_A, "序号")
         contract_col = get_column_by_name(ws_A, "合同编号")
         if serial_col and contract_col:
             col_letter = get_column_letter(contract_col)
-            for r in range(2, ws_A.max_row + 1): ws_A.cell(row=r, column=serial_col, value=f'=SUBTOTAL(103, ${col_letter}$2:{col_letter}{r})')
-        numeric_cols = ["合同数量", "合同单价", "合同金额", "应收保证金金额", "已收定金", "逾期初始保证金"]
-        for col_name in numeric_cols:
-            col_idx = get_column_by_name(ws_A, col_name)
-            if col_idx:
-                for r in range(2, ws_A.max_row + 1):
-                    cell = ws_A.cell(row=r, column=col_idx)
-                    try:
-                        if cell.value:
-                            cell.value = float(cell.value)
-                            cell.number_format = '0.00'
-                    except: pass
-        pct_col = get_column_by_name(ws_A, "应收保证金比例")
-        if pct_col:
+            serial_letter = get_column_letter(serial_col)
             for r in range(2, ws_A.max_row + 1):
-                cell = ws_A.cell(row=r, column=pct_col)
-                try:
-                    if cell.value:
-                        cell.value = float(cell.value)
-                        cell.number_format = '0%'
-                except: pass
+                if serial_mode == "subtotal": formula = f'=SUBTOTAL(103, ${col_letter}$2:{col_letter}{r})'
+                elif r == 2: formula = f'=SUBTOTAL(103, {col_letter}{r})'
+                else: formula = f'={serial_letter}{r - 1}+SUBTOTAL(103, {col_letter}{r})'
+                ws_A.cell(row=r, column=serial_col, value=formula)
+        for col_name, number_format in A_NUMBER_FORMATS.items():
+            col_idx = get_column_by_name(ws_A, col_name)
+            if not col_idx: continue
+            fmt_id = None
+            for (cell,) in ws_A.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx):
+                if not isinstance(cell.value, float) or not cell.value: continue
+                if fmt_id is None:
+                    cell.number_format = number_format
+                    fmt_id = cell._style.numFmtId
+                else: style_array(cell).numFmtId = fmt_id
         return True
     except: return False
 
-def optimize_A_sheet_formatting(ws_A):
+def add_A_conditional_highlight(ws_A, date_column):
+    """以条件格式表达到期/逾期高亮：规则基于日期列与 TODAY()，文件在之后的日期打开时仍然正确"""
+    if ws_A.max_row < 2: return
+    date_letter = get_column_letter(date_column)
+    last_letter = get_column_letter(ws_A.max_column)
+    due_formula = f'AND(${date_letter}2<>"",DATEVALUE(${date_letter}2)<=TODAY())'
+    overdue_formula = f'AND(${date_letter}2<>"",DATEVALUE(${date_letter}2)<TODAY())'
+    ws_A.conditional_formatting.add(f"A2:{last_letter}{ws_A.max_row}", FormulaRule(formula=[due_formula], font=Font(color="8B0000")))
+    ws_A.conditional_formatting.add(f"{date_letter}2:{date_letter}{ws_A.max_row}",
+                                    FormulaRule(formula=[overdue_formula], fill=PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")))
+
+def optimize_A_sheet_formatting(ws_A, flags, highlight_mode="cells"):
+    """highlight_mode: "cells" 逐格写入字体/填充；"conditional" 改为写入工作表条件格式规则"""
     try:
-        today = datetime.now().date()
         date_column = get_column_by_name(ws_A, "应收保证金日期")
-        if date_column:
+        if date_column and highlight_mode == "conditional":
+            add_A_conditional_highlight(ws_A, date_column)
+        elif date_column:
             dark_red_font = Font(color="8B0000")
             yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-            for row in range(2, ws_A.max_row + 1):
-                cell = ws_A.cell(row=row, column=date_column)
-                try:
-                    if cell.value:
-                        cell_date_str = str(cell.value)
-                        cell_date = None
-                        for fmt in ["%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d"]:
-                            try:
-                                cell_date = datetime.strptime(cell_date_str, fmt).date()
-                                break
-                            except: continue
-                        if cell_date and cell_date <= today:
-                            for col in range(1, ws_A.max_column + 1): ws_A.cell(row=row, column=col).font = dark_red_font
-                            if cell_date < today: cell.fill = yellow_fill
-                except: continue
+            overdue = flags['overdue'].to_numpy()
+            for i in np.flatnonzero(flags['due'].to_numpy()):
+                row = int(i) + 2
+                for col in range(1, ws_A.max_column + 1): ws_A.cell(row=row, column=col).font = dark_red_font
+                if overdue[i]: ws_A.cell(row=row, column=date_column).fill = yellow_fill
         beautify_sheet_common(ws_A, title_color="BDD7EE")
         right_align_keywords = ["应收保证金日期", "应收保证金比例", "应收保证金金额", "已收定金/预收款", "逾期初始保证金金额"]
         right_align = Alignment(horizontal='right', vertical='center', wrap_text=True)
@@ -266,28 +346,21 @@ def optimize_A_sheet_formatting(ws_A):
         auto_fit_columns(ws_A)
     except: pass
 
-def create_A_summary_sheet(workbook, ws_A, today_date_str):
+def create_A_summary_sheet(workbook, df_A, flags, today_date_str):
     try:
         if "A类逾期明细汇总" in workbook.sheetnames: del workbook["A类逾期明细汇总"]
         ws_summary = workbook.create_sheet("A类逾期明细汇总")
         ws_summary.append(["业务部门", "提醒内容"])
         today_date = datetime.strptime(today_date_str, "%Y.%m.%d")
         yesterday_str = (today_date - timedelta(days=1)).strftime("%m月%d日")
-        business_dept_col = get_column_by_name(ws_A, "业务部门")
-        date_col = get_column_by_name(ws_A, "应收保证金日期")
+        business_dept_col = next((c for c in df_A.columns if "业务部门" in str(c)), None)
+        date_col = next((c for c in df_A.columns if "应收保证金日期" in str(c)), None)
         if not business_dept_col or not date_col: return False, []
-        dept_stats = {}
-        for row in range(2, ws_A.max_row + 1):
-            dept_name = ws_A.cell(row=row, column=business_dept_col).value
-            if not dept_name: dept_name = "未知部门"
-            if dept_name not in dept_stats: dept_stats[dept_name] = {'total': 0, 'yellow_cells': 0, 'non_yellow_cells': 0}
-            dept_stats[dept_name]['total'] += 1
-            cell_fill = ws_A.cell(row=row, column=date_col).fill
-            is_yellow = False
-            if cell_fill and cell_fill.start_color and cell_fill.start_color.rgb:
-                if str(cell_fill.start_color.rgb).endswith("FFFF00"): is_yellow = True
-            if is_yellow: dept_stats[dept_name]['yellow_cells'] += 1
-            else: dept_stats[dept_name]['non_yellow_cells'] += 1
+        dept = df_A[business_dept_col]
+        dept = dept.where(dept.notna() & (dept != ""), "未知部门")
+        counts = pd.DataFrame({'dept': dept.to_numpy(), 'overdue': flags['overdue'].to_numpy()}).groupby('dept', sort=False)['overdue'].agg(['size', 'sum'])
+        dept_stats = {name: {'total': int(total), 'yellow_cells': int(n_over), 'non_yellow_cells': int(total - n_over)}
+                      for name, total, n_over in counts.itertuples(name=None)}
         logs = []
         row_idx = 2
         for dept_name, stats in dept_stats.items():
@@ -320,45 +393,261 @@ def create_A_summary_sheet(workbook, ws_A, today_date_str):
         return True, logs
     except: return False, []
 
-def process_margin_deposit_logic(current_file, prev_file):
+def normalize_contract_ids(series):
+    ids = series.astype(str).str.strip()
+    return ids.mask(series.isna() | ids.isin(["", "nan", "None"]))
+
+def reason_text_column(df, name):
+    if name not in df.columns: return pd.Series("", index=df.index, dtype=object)
+    col = df[name]
+    return col.where(col.notna(), "").astype(str).where(col.notna(), "")
+
+def latest_reasons(df, reason_col="逾期具体原因", category_col="逾期原因分类"):
+    """每个合同编号保留一条原因：取最后一条非空原因，全为空时取最后一条；返回 (去重结果, 重复行数)"""
+    reasons = pd.DataFrame({
+        "合同编号": normalize_contract_ids(df["合同编号"]),
+        "逾期具体原因": reason_text_column(df, reason_col),
+        "逾期原因分类": reason_text_column(df, category_col),
+    }).dropna(subset=["合同编号"])
+    has_reason = (reasons["逾期具体原因"].str.strip() != "") | (reasons["逾期原因分类"].str.strip() != "")
+    collided = int(reasons["合同编号"].duplicated().sum())
+    reasons = (reasons.assign(_has=has_reason.astype(int), _pos=range(len(reasons)))
+                      .sort_values(["_has", "_pos"], kind="stable")
+                      .drop_duplicates("合同编号", keep="last")
+                      .drop(columns=["_has", "_pos"]))
+    return reasons, collided
+
+def carry_over_reasons(df_today, df_last):
+    """按合同编号将对照日的逾期原因合并到今日数据；对照日重复的合同编号取最后一条非空原因"""
+    prev, collided = latest_reasons(df_last)
+    prev = prev.rename(columns={"逾期具体原因": "逾期具体原因_新", "逾期原因分类": "逾期原因分类_新"})
+    keys = normalize_contract_ids(df_today["合同编号"])
+    joined = pd.DataFrame({"合同编号": keys}).merge(prev, on="合同编号", how="left", validate="many_to_one")
+    df_today = df_today.copy()
+    df_today["合同编号"] = df_today["合同编号"].astype(str).str.strip()
+    for col in ["逾期具体原因_新", "逾期原因分类_新"]: df_today[col] = joined[col].fillna("").to_numpy()
+    matched = int(joined["逾期具体原因_新"].notna().sum())
+    stats = {"matched": matched, "missing": len(df_today) - matched, "collided": collided}
+    return df_today, stats
+
+# ---------------------------------------------------------------------------
+# 合同原因历史库：按日增量入库，按合同编号查找最近一次已知原因，对照日报表因此可选
+# ---------------------------------------------------------------------------
+
+REASON_STORE_PATH = os.environ.get(
+    "CTMR_REASON_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "reason_history.sqlite3"))
+# 多日回溯默认写入独立的历史库，避免改写日常使用的历史库
+BACKFILL_STORE_PATH = os.environ.get(
+    "CTMR_BACKFILL_REASON_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "reason_history_backfill.sqlite3"))
+
+def open_reason_store(path=REASON_STORE_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS contract_reason (
+                        contract_id TEXT NOT NULL,
+                        as_of TEXT NOT NULL,
+                        reason TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        PRIMARY KEY (contract_id, as_of)
+                    ) WITHOUT ROWID""")
+    return conn
+
+def open_reason_store_safe(path, logs):
+    """历史库可选：打不开（目录不可建/不可写等）时记一条日志并返回 None，改由对照日报表带入原因"""
+    if not path: return None
+    try: return open_reason_store(path)
+    except (OSError, sqlite3.Error) as e:
+        logs.append(f"⚠️ 合同原因历史库不可用，本次不使用历史库: {e}")
+        return None
+
+def ingest_reason_history(conn, df, as_of, reason_col="逾期具体原因", category_col="逾期原因分类"):
+    """写入某一天的合同原因快照；同一天重复入库时整体替换，只保存非空原因"""
+    reasons, _ = latest_reasons(df, reason_col, category_col)
+    reasons = reasons[(reasons["逾期具体原因"].str.strip() != "") | (reasons["逾期原因分类"].str.strip() != "")]
+    day = as_of.strftime("%Y-%m-%d")
+    with conn:
+        conn.execute("DELETE FROM contract_reason WHERE as_of = ?", (day,))
+        conn.executemany("INSERT INTO contract_reason (contract_id, as_of, reason, category) VALUES (?, ?, ?, ?)",
+                         ((cid, day, r, c) for cid, r, c in reasons.itertuples(index=False, name=None)))
+    return len(reasons)
+
+def has_reason_snapshot(conn, as_of):
+    return conn.execute("SELECT 1 FROM contract_reason WHERE as_of = ? LIMIT 1", (as_of.strftime("%Y-%m-%d"),)).fetchone() is not None
+
+def lookup_reason_history(conn, contract_ids, before):
+    """查找 before 之前各合同编号最近一次的已知原因，返回与对照日报表同结构的 DataFrame"""
+    ids = normalize_contract_ids(contract_ids).dropna().unique()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_contract (contract_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM wanted_contract")
+    conn.executemany("INSERT OR IGNORE INTO wanted_contract (contract_id) VALUES (?)", ((cid,) for cid in ids))
+    rows = conn.execute("""SELECT h.contract_id, h.reason, h.category, MAX(h.as_of)
+                           FROM contract_reason h JOIN wanted_contract w ON h.contract_id = w.contract_id
+                           WHERE h.as_of < ?
+                           GROUP BY h.contract_id""", (before.strftime("%Y-%m-%d"),)).fetchall()
+    return pd.DataFrame([r[:3] for r in rows], columns=["合同编号", "逾期具体原因", "逾期原因分类"])
+
+def load_previous_reasons(df_today, prev_file, store, as_of, logs):
+    """
+    上传了对照日报表时按文件名中的日期入库（该日已有快照则不覆盖）；启用历史库时按今日合同编号查最近一次原因
+    文件名无日期时不入库，其原因排在历史库结果之后直接参与带入（同一合同优先取它）
+    历史库读写失败时关闭并弃用（记日志），由对照日报表带入原因
+    返回 (原因来源 DataFrame, 对照日报表 DataFrame 或 None, 仍可用的历史库或 None)
+    """
+    df_prev = df_last = None
+    if prev_file is not None:
+        df_prev = read_excel_safe(prev_file)
+        df_prev = df_last = df_prev.loc[:, ~df_prev.columns.str.contains('^Unnamed')]
+    if store is not None:
+        try:
+            prev_day = None
+            if df_prev is not None:
+                prev_day = snapshot_date(prev_file if isinstance(prev_file, str) else getattr(prev_file, "name", "") or "")
+                if prev_day is None: logs.append("⚠️ 对照日报表文件名中没有日期，未写入合同原因历史库")
+                elif prev_day >= as_of: logs.append(f"⚠️ 对照日报表日期 {prev_day} 不早于今日，未写入合同原因历史库")
+                elif has_reason_snapshot(store, prev_day): logs.append(f"ℹ️ 合同原因历史库已有 {prev_day} 的快照，未覆盖")
+                else: ingest_reason_history(store, df_prev, prev_day)
+            df_last = lookup_reason_history(store, df_today['合同编号'], before=as_of)
+            if df_prev is not None and (prev_day is None or prev_day >= as_of): df_last = pd.concat([df_last, df_prev], ignore_index=True)
+        except (OSError, sqlite3.Error) as e:
+            logs.append(f"⚠️ 合同原因历史库读写失败，本次不使用历史库: {e}")
+            store.close()
+            store = None
+    if df_last is None: raise ValueError("未上传对照日报表，且未启用合同原因历史库。")
+    return df_last, df_prev, store
+
+def effective_reasons(df_today):
+    """原表已填写的原因优先，否则取本次补全的原因，即输出文件中最终呈现的原因"""
+    reason = reason_text_column(df_today, "逾期具体原因")
+    category = reason_text_column(df_today, "逾期原因分类")
+    return pd.DataFrame({
+        "合同编号": df_today["合同编号"],
+        "逾期具体原因": reason.where(reason.str.strip() != "", df_today["逾期具体原因_新"]),
+        "逾期原因分类": category.where(category.str.strip() != "", df_today["逾期原因分类_新"]),
+    })
+
+def apply_reason_defaults(df_today):
+    """对照日/历史库都没有原因的合同，按是否约定保证金条款补默认原因"""
+    mask_empty = (df_today["逾期原因分类_新"] == "") & (df_today["逾期具体原因_新"] == "")
+    if mask_empty.any():
+        clause_col = "是否约定保证金条款"
+        if clause_col in df_today.columns:
+            df_today.loc[mask_empty & (df_today[clause_col] == "是"), ["逾期具体原因_新", "逾期原因分类_新"]] = ["保证金待收取，已催收", "A实际已逾期：指未按合同约定及时足额支付初始保证金。"]
+            df_today.loc[mask_empty & (df_today[clause_col] == "否"), ["逾期具体原因_新", "逾期原因分类_新"]] = ["合同未约定收取保证金", "C无需收取保证金：指政策性业务、对养殖户销售业务、分合同、公司批准免收保证金客户的。此类要写明不收取保证金的具体原因。"]
+    return df_today
+
+def join_stats_log(join_stats):
+    return f"🔗 历史原因匹配：命中 {join_stats['matched']} 条，未匹配 {join_stats['missing']} 条，来源重复合同编号 {join_stats['collided']} 条（取最新非空原因）"
+
+# ---------------------------------------------------------------------------
+# 对照日差异：按合同编号哈希连接，以金额/日期/原因分类的行指纹判断变更
+# ---------------------------------------------------------------------------
+
+DIFF_FIELDS = ["合同金额", "应收保证金日期", "逾期原因分类"]
+DIFF_KIND_ORDER = {"新增": 0, "变更": 1, "已解除": 2}
+
+def contract_fingerprints(df, category):
+    """每个合同编号一行（重复取最后一行），附带比较字段的规范化值与行指纹 _fp"""
+    def find(name):
+        return next((c for c in df.columns if name in str(c)), None)
+    amount_col, date_col = find("合同金额"), find("应收保证金日期")
+    dept_col, client_col = find("业务部门"), find("客户")
+    frame = pd.DataFrame({
+        "合同编号": normalize_contract_ids(df["合同编号"]).to_numpy(),
+        "业务部门": df[dept_col].to_numpy() if dept_col else None,
+        "客户": df[client_col].to_numpy() if client_col else None,
+        "合同金额": pd.to_numeric(df[amount_col], errors='coerce').round(2).to_numpy() if amount_col else np.nan,
+        "应收保证金日期": pd.to_datetime(df[date_col], errors='coerce').dt.strftime('%Y-%m-%d').to_numpy() if date_col else None,
+        "逾期原因分类": category.str.strip().to_numpy(),
+    }).dropna(subset=["合同编号"]).drop_duplicates("合同编号", keep="last")
+    frame["_fp"] = pd.util.hash_pandas_object(frame[DIFF_FIELDS], index=False).to_numpy()
+    return frame
+
+def diff_contract_snapshots(df_today, df_prev):
+    """
+    今日与对照日的合同差异：新增 / 已解除 / 变更（金额、应收保证金日期或原因分类变化）
+    今日的原因分类取输出中最终呈现的值；返回 (差异 DataFrame, {类型: 笔数})
+    """
+    today = contract_fingerprints(df_today, effective_reasons(df_today)["逾期原因分类"])
+    prev = contract_fingerprints(df_prev, reason_text_column(df_prev, "逾期原因分类"))
+    merged = today.merge(prev, on="合同编号", how="outer", suffixes=("_今日", "_对照日"), indicator=True)
+    kind = pd.Series(np.select([merged["_merge"] == "left_only", merged["_merge"] == "right_only",
+                                merged["_fp_今日"] != merged["_fp_对照日"]], ["新增", "已解除", "变更"], default=""), index=merged.index)
+    merged = merged.assign(变动类型=kind)[kind != ""]
+    changed = pd.DataFrame({f: ~((merged[f"{f}_今日"] == merged[f"{f}_对照日"]) | (merged[f"{f}_今日"].isna() & merged[f"{f}_对照日"].isna()))
+                            for f in DIFF_FIELDS}, index=merged.index)
+    fields = changed.dot(pd.Series([f"{f}、" for f in DIFF_FIELDS], index=DIFF_FIELDS)).str.rstrip("、")
+    result = pd.DataFrame({
+        "变动类型": merged["变动类型"],
+        "合同编号": merged["合同编号"],
+        "业务部门": merged["业务部门_今日"].combine_first(merged["业务部门_对照日"]),
+        "客户": merged["客户_今日"].combine_first(merged["客户_对照日"]),
+        "变动字段": fields.where(merged["变动类型"] == "变更", ""),
+    })
+    for f in DIFF_FIELDS:
+        result[f"{f}(对照日)"] = merged[f"{f}_对照日"]
+        result[f"{f}(今日)"] = merged[f"{f}_今日"]
+    result = result.sort_values(["变动类型", "合同编号"], key=lambda s: s.map(DIFF_KIND_ORDER) if s.name == "变动类型" else s, kind="stable")
+    counts = {k: int((result["变动类型"] == k).sum()) for k in DIFF_KIND_ORDER}
+    return result.reset_index(drop=True), counts
+
+def create_diff_sheet(workbook, df_diff):
+    if "对照日差异" in workbook.sheetnames: del workbook["对照日差异"]
+    ws_diff = workbook.create_sheet("对照日差异")
+    ws_diff.append(list(df_diff.columns))
+    for row in df_diff.astype(object).where(df_diff.notna(), None).itertuples(index=False, name=None): ws_diff.append(row)
+    beautify_sheet_common(ws_diff, title_color="BDD7EE")
+    auto_fit_columns(ws_diff)
+
+def diff_stats_log(counts):
+    return f"🔁 对照日差异：新增 {counts['新增']} 笔，已解除 {counts['已解除']} 笔，变更 {counts['变更']} 笔"
+
+def render_margin_workbook(book, ws_main, header_row, df_today, as_of, highlight_mode="cells", df_diff=None):
+    """在已加载的工作簿上生成 A类逾期明细/汇总（及对照日差异）并回填原表，返回通报日志"""
+    for s in ["A类逾期明细", "A类逾期明细汇总"]:
+        if s in book.sheetnames: del book[s]
+    df_A = build_A_frame(df_today[df_today["逾期原因分类_新"] == "A实际已逾期：指未按合同约定及时足额支付初始保证金。"])
+    df_A, unparsable = coerce_A_numeric(df_A)
+    flags_A = A_row_flags(df_A, as_of)
+    ws_A = book.create_sheet("A类逾期明细")
+    clean_and_organize_A_sheet(ws_A, df_A)
+    optimize_A_sheet_formatting(ws_A, flags_A, highlight_mode)
+    success, logs = create_A_summary_sheet(book, df_A, flags_A, as_of.strftime("%Y.%m.%d"))
+    for col, values in unparsable.items():
+        logs.append(f"⚠️ A类逾期明细「{col}」列有 {len(values)} 个值无法识别为数字，已保留原值：{'、'.join(values[:5])}")
+    if df_diff is not None: create_diff_sheet(book, df_diff)
+    fill_original_sheet_columns(ws_main, df_today, header_row)
+    return logs
+
+def process_margin_deposit_logic(current_file, prev_file=None, store_path=REASON_STORE_PATH, highlight_mode="cells"):
+    """
+    初始保证金处理核心逻辑
+    prev_file: 对照日报表，可选；未上传时从本地合同原因历史库 (store_path) 取各合同最近一次的原因
+    store_path: 为 None 时不使用历史库
+    highlight_mode: A类逾期明细的到期/逾期高亮方式，"cells" | "conditional"
+    """
+    store = None
     try:
-        book = openpyxl.load_workbook(current_file)
-        if "WSBZJQKB" in book.sheetnames: remove_empty_rows(book["WSBZJQKB"])
-        temp_stream = io.BytesIO()
-        book.save(temp_stream)
-        temp_stream.seek(0)
-        df_today = read_excel_safe(temp_stream)
-        df_last = read_excel_safe(prev_file)
+        # 数据取自只读 data_only 解析（公式取缓存值）；带样式的完整加载只用于生成输出
+        early_logs = []
+        header_row, df_today = read_margin_snapshot(current_file, early_logs)
         df_today = df_today.loc[:, ~df_today.columns.str.contains('^Unnamed')]
-        df_last = df_last.loc[:, ~df_last.columns.str.contains('^Unnamed')]
-        mapping = {}
-        for _, row in df_last.iterrows():
-            cid = str(row.get('合同编号', '')).strip()
-            if cid and cid != 'nan': mapping[cid] = {'r': row.get('逾期具体原因', ''), 'c': row.get('逾期原因分类', '')}
-        df_today['合同编号'] = df_today['合同编号'].astype(str).str.strip()
-        df_today["逾期具体原因_新"] = df_today["合同编号"].apply(lambda x: mapping.get(x, {}).get('r', ''))
-        df_today["逾期原因分类_新"] = df_today["合同编号"].apply(lambda x: mapping.get(x, {}).get('c', ''))
-        mask_empty = df_today["逾期原因分类_新"] == ""
-        if mask_empty.any():
-            clause_col = "是否约定保证金条款"
-            if clause_col in df_today.columns:
-                df_today.loc[mask_empty & (df_today[clause_col] == "是"), ["逾期具体原因_新", "逾期原因分类_新"]] = ["保证金待收取，已催收", "A实际已逾期：指未按合同约定及时足额支付初始保证金。"]
-                df_today.loc[mask_empty & (df_today[clause_col] == "否"), ["逾期具体原因_新", "逾期原因分类_新"]] = ["合同未约定收取保证金", "C无需收取保证金：指政策性业务、对养殖户销售业务、分合同、公司批准免收保证金客户的。此类要写明不收取保证金的具体原因。"]
-        temp_stream.seek(0)
-        book = openpyxl.load_workbook(temp_stream)
-        for s in ["WSBZJQKB_Processed", "A类逾期明细", "A类逾期明细汇总"]:
-            if s in book.sheetnames: del book[s]
-        ws_proc = book.create_sheet("WSBZJQKB_Processed")
-        for r in dataframe_to_rows(df_today, index=False, header=True): ws_proc.append(r)
-        df_A = df_today[df_today["逾期原因分类_新"] == "A实际已逾期：指未按合同约定及时足额支付初始保证金。"].copy()
-        ws_A = book.create_sheet("A类逾期明细")
-        for r in dataframe_to_rows(df_A, index=False, header=True): ws_A.append(r)
-        clean_and_organize_A_sheet(ws_A)
-        optimize_A_sheet_formatting(ws_A)
-        today_str = datetime.now().strftime("%Y.%m.%d")
-        success, logs = create_A_summary_sheet(book, ws_A, today_str)
-        if "WSBZJQKB" in book.sheetnames: fill_original_sheet_columns(book["WSBZJQKB"], df_today)
-        if "WSBZJQKB_Processed" in book.sheetnames: del book["WSBZJQKB_Processed"]
+        if hasattr(current_file, "seek"): current_file.seek(0)
+        book = openpyxl.load_workbook(current_file)
+        ws_main = book["WSBZJQKB"]
+        as_of = datetime.now().date()
+        store = open_reason_store_safe(store_path, early_logs)
+        df_last, df_prev, store = load_previous_reasons(df_today, prev_file, store, as_of, early_logs)
+        df_today, join_stats = carry_over_reasons(df_today, df_last)
+        df_today = apply_reason_defaults(df_today)
+        df_diff, diff_counts = diff_contract_snapshots(df_today, df_prev) if df_prev is not None else (None, None)
+        logs = early_logs + render_margin_workbook(book, ws_main, header_row, df_today, as_of, highlight_mode, df_diff)
+        logs.append(join_stats_log(join_stats))
+        if diff_counts: logs.append(diff_stats_log(diff_counts))
+        if store is not None:
+            try: ingest_reason_history(store, effective_reasons(df_today), as_of)
+            except sqlite3.Error as e: logs.append(f"⚠️ 合同原因历史库写入失败: {e}")
         output = io.BytesIO()
         book.save(output)
         output.seek(0)
@@ -366,3 +655,86 @@ def process_margin_deposit_logic(current_file, prev_file):
     except Exception as e:
         import traceback
         return None, [f"❌ 处理出错: {str(e)}", traceback.format_exc()]
+    finally:
+        if store is not None: store.close()
+
+# ---------------------------------------------------------------------------
+# 多日回溯：按文件名中的日期逐日处理一个目录下的 WSBZJQKB 日报
+# ---------------------------------------------------------------------------
+
+SNAPSHOT_DATE_PATTERN = re.compile(r"(20\d{2})[-._年]?(\d{1,2})[-._月]?(\d{1,2})")
+
+def snapshot_date(path):
+    match = SNAPSHOT_DATE_PATTERN.search(os.path.basename(path))
+    if not match: return None
+    try: return date(*(int(g) for g in match.groups()))
+    except ValueError: return None
+
+def parse_margin_snapshot(path):
+    """进程池任务：只读解析一天的 WSBZJQKB，返回 (标题行号, DataFrame)"""
+    header_row, df = read_margin_snapshot(path)
+    return header_row, df.loc[:, ~df.columns.str.contains('^Unnamed')]
+
+def render_margin_snapshot(path, out_path, header_row, df_today, as_of, highlight_mode, df_diff=None):
+    """进程池任务：加载原始工作簿，生成当日输出并保存到 out_path"""
+    book = openpyxl.load_workbook(path)
+    logs = render_margin_workbook(book, book["WSBZJQKB"], header_row, df_today, as_of, highlight_mode, df_diff)
+    book.save(out_path)
+    return logs
+
+def backfill_margin_deposits(folder, output_dir, store_path=BACKFILL_STORE_PATH, highlight_mode="cells", max_workers=None):
+    """
+    批量回溯：folder 下文件名带日期的 .xlsx 按日期顺序处理，每日的最终原因依次带入下一日
+    解析与输出生成在进程池中并行，只有依赖前一日结果的原因带入串行执行
+    store_path: 默认为独立的回溯历史库，不改写日常历史库；为 None 时不使用历史库
+    返回按日期排列的 [(日期, 输出路径或 None, 日志列表)]
+    """
+    if os.path.realpath(folder) == os.path.realpath(output_dir):
+        raise ValueError("输出目录不能与输入目录相同，以免覆盖原始报表。")
+    days = sorted((d, p) for p in glob.glob(os.path.join(folder, "*.xlsx"))
+                  if not os.path.basename(p).startswith("~$") and (d := snapshot_date(p)) is not None)
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    store = open_reason_store(store_path) if store_path else None
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            parsed = [pool.submit(parse_margin_snapshot, path) for _, path in days]
+            pending = []
+            prev = pd.DataFrame(columns=["合同编号", "逾期具体原因", "逾期原因分类"])
+            prev_day = None
+            for (as_of, path), future in zip(days, parsed):
+                try: header_row, df_today = future.result()
+                except Exception as e:
+                    results.append((as_of, None, [f"❌ {os.path.basename(path)} 解析失败: {e}"]))
+                    continue
+                df_last = lookup_reason_history(store, df_today['合同编号'], before=as_of) if store is not None else prev
+                df_today, join_stats = carry_over_reasons(df_today, df_last)
+                df_today = apply_reason_defaults(df_today)
+                df_diff, diff_counts = diff_contract_snapshots(df_today, prev_day) if prev_day is not None else (None, None)
+                prev = effective_reasons(df_today)
+                prev_day = df_today.assign(逾期原因分类=prev["逾期原因分类"])
+                if store is not None: ingest_reason_history(store, prev, as_of)
+                out_path = os.path.join(output_dir, os.path.basename(path))
+                day_logs = [join_stats_log(join_stats)] + ([diff_stats_log(diff_counts)] if diff_counts else [])
+                pending.append((as_of, out_path, day_logs,
+                                pool.submit(render_margin_snapshot, path, out_path, header_row, df_today, as_of, highlight_mode, df_diff)))
+            for as_of, out_path, day_logs, future in pending:
+                try: results.append((as_of, out_path, future.result() + day_logs))
+                except Exception as e: results.append((as_of, None, [f"❌ {os.path.basename(out_path)} 生成失败: {e}"]))
+    finally:
+        if store is not None: store.close()
+    results.sort(key=lambda item: item[0])
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="初始保证金多日回溯处理")
+    parser.add_argument("folder", help="存放按日期命名的 WSBZJQKB 日报的目录")
+    parser.add_argument("output_dir", help="处理结果输出目录")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--store", default=BACKFILL_STORE_PATH,
+                        help=f"合同原因历史库路径，默认 {BACKFILL_STORE_PATH}（与日常历史库分开）；传空字符串则不使用历史库")
+    args = parser.parse_args()
+    for day, out_path, day_logs in backfill_margin_deposits(args.folder, args.output_dir, store_path=args.store or None, max_workers=args.workers):
+        print(f"== {day} -> {out_path or '失败'}")
+        for line in day_logs: print(line)
@@ -0,0 +1,60 @@
+from openpyxl.utils import get_column_letter
+
+# ==================== 有效数据范围（各模块共用） ====================
+# 源表常带有延伸到 XFD 列 / 1048576 行的空格式，max_row / max_column 因此失真；
+# 这里按“最后一个非空值”计算真实范围，供各处循环限界
+
+def sheet_extent(ws):
+    """工作表真实数据范围 (末行, 末列)；普通工作表只看已存在的单元格，只读工作表流式扫描一遍；空表为 (0, 0)"""
+    cells = getattr(ws, "_cells", None)
+    if cells is None: return read_bounded_rows(ws)[2]
+    last_row = last_col = 0
+    for (r, c), cell in cells.items():
+        if cell.value is None: continue
+        if r > last_row: last_row = r
+        if c > last_col: last_col = c
+    return last_row, last_col
+
+def declared_extent(ws):
+    """工作表自身声明的范围 (max_row, max_column)，未声明时为 0"""
+    try: return ws.max_row or 0, ws.max_column or 0
+    except: return 0, 0
+
+def trim_rows(rows):
+    """
+    流式截掉范围外的空行/空列：返回 (行列表, (末行, 末列))
+    范围内的行统一截到末列（不足的保持原长），与原先按 max_column 读取的结果一致
+    """
+    kept, last_row, last_col = [], 0, 0
+    for idx, row in enumerate(rows, 1):
+        n = len(row)
+        while n and row[n - 1] is None: n -= 1
+        kept.append((tuple(row[:n]), len(row)))
+        if n:
+            last_row = idx
+            if n > last_col: last_col = n
+    return [r + (None,) * (min(length, last_col) - len(r)) for r, length in kept[:last_row]], (last_row, last_col)
+
+def read_bounded_rows(ws, max_rows=None):
+    """
+    按真实数据范围读取表的值（可只读前 max_rows 行）：返回 (行列表, 声明范围, 有效范围)
+    普通工作表先算范围再限界读取，避免 iter_rows 为空格式区域创建单元格；只读工作表边读边截
+    """
+    declared = declared_extent(ws)
+    if getattr(ws, "_cells", None) is None:
+        if hasattr(ws, "reset_dimensions"): ws.reset_dimensions()
+        rows, used = trim_rows(ws.iter_rows(max_row=max_rows, values_only=True))
+        return rows, declared, used
+    used = sheet_extent(ws)
+    if not all(used): return [], declared, used
+    max_row = used[0] if max_rows is None else min(used[0], max_rows)
+    return list(ws.iter_rows(max_row=max_row, max_col=used[1], values_only=True)), declared, used
+
+def extent_ref(extent):
+    last_row, last_col = extent
+    return f"A1:{get_column_letter(last_col)}{last_row}" if last_row and last_col else "空表"
+
+def extent_log(title, declared, used):
+    """声明范围大于有效范围时返回一条日志，否则返回 None"""
+    if declared[0] <= used[0] and declared[1] <= used[1]: return None
+    return f"📐 {title}：有效数据范围 {extent_ref(used)}（工作表声明 {extent_ref(declared)}），已按有效范围处理"